@@ -5,23 +5,27 @@ Replaces the previous Gradio UI. Preserves language selection and RAG tool calli
 """
 
 import os
+import re
 import json
+import inspect
+import asyncio
+import atexit
 import logging
-from typing import Optional, List, Dict, Any
+import logging.handlers
+import threading
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, Tuple, TypeVar
 
+import httpx
+import openai
 import streamlit as st
-from openai import OpenAI
-from pydantic import BaseModel, Field
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from pydantic import BaseModel, Field, ValidationError
 from pydantic_core import PydanticOmit
 from langchain_core.utils.function_calling import convert_to_openai_function
 
-from prompts import (
-    PRODUCT_SEARCH_SELECTION,
-    PRODUCT_INFORMATION_DETAILS,
-    PRODUCT_COMPARISON,
-    GENERAL_ASSORTMENT_INQUIRY
-)
+from prompts import INPUT_ANALYSIS, INTENT_ROUTING, PREFERENCE_BATCH, SHOPPING_ASSISTANT
 from retrieval import ProductRetriever
+from cache import ResponseCache, SemanticCache
 
 # --- Intent Routing ---
 from enum import Enum
@@ -55,25 +59,221 @@ class UserPreference(BaseModel):
     color: Optional[str] = Field(None, description="The user's preferred color for the product.")
 
 
-class PreferenceExtractor(BaseModel):
-    """Extracts user preferences from a conversation."""
+# Cheap pre-filter for terms that can carry a preference (specs, price, CPU/GPU, color) in
+# English or Russian. Messages without any of them ("ok", "compare them", "спасибо") skip the
+# preference part of the analysis. It runs on what is left after local extraction (brands, RAM, budget).
+PREF_HINT_RE = re.compile(
+    r"\d+\s*(?:gb|tb|гб|тб)|\$\s*\d|\d{3,}|"
+    r"\b(?:ram|memory|ssd|hdd|storage|inch(?:es)?|screen|display|dollars?|usd|price|budget|cheap(?:er)?|"
+    r"intel|amd|ryzen|apple|nvidia|geforce|rtx|gtx|radeon|gpu|graphics|cpu|processors?|"
+    r"colou?r|black|white|silver|gr[ae]y|blue|red|gold|pink|prefer)\b|"
+    r"(?:озу|памят|накопител|хранилищ|диск|экран|дюйм|цен|бюджет|дешевл|доллар|процессор|интел|видеокарт|"
+    r"графи|цвет|черн|бел|серебрист|син|красн|предпоч)",
+    re.IGNORECASE,
+)
+
+# Unambiguous RAM and budget phrasings are extracted locally ("32GB RAM", "under $2000",
+# "дешевле 1500 долларов"); anything else is left to the model.
+RAM_PREF_RE = re.compile(
+    r"(\d+)\s*(?:gb|гб)\s+(?:of\s+)?(?:ram|memory|озу|оперативн\w*(?:\s+памят\w*)?)\b|"
+    r"\b(?:ram|озу)\s*(\d+)\s*(?:gb|гб)\b",
+    re.IGNORECASE,
+)
+_CURRENCY = r"(?:\$|usd\b|dollars?\b|доллар\w*)"
+_PRICE_WORD = r"(?:price|budget|costs?|цен\w*|бюджет\w*|стоимост\w*)"
+# A number followed by a unit is a size, weight, duration or year, never a budget ("under 15 inches").
+# An amount may be shortened with "k" ("$1.5k", "2k"). A number followed by a unit is a size,
+# weight, duration or year, never a budget ("under 15 inches").
+_AMOUNT = (
+    r"(\d[\d,]*(?:\.\d+)?(?:k\b)?)"
+    r"(?![\d,]|\.\d|\s*(?:gb|tb|гб|тб|inch|\"|дюйм|kg|кг|hour|hrs|час|year|год|mm|мм))"
+)
+# A negated bound means the opposite one ("no more than $1500" is a maximum), so the plain bound
+# must not match right after a negation.
+_NOT_NEGATED = r"(?<!\bno\s)(?<!\bnot\s)(?<!\bне\s)"
+
+def _budget_re(bounds: str, price_bounds: str) -> re.Pattern:
+    """Matches a budget bound: a generic bound ("under", "до") only next to a currency or a price
+    word ("under $2000", "до 1500 долларов", "бюджет до 1500"); a bound that is itself about
+    price ("cheaper than", "дешевле") with any amount."""
+    return re.compile(
+        rf"\b{_NOT_NEGATED}(?:{bounds})\s*\$\s*{_AMOUNT}|"
+        rf"\b{_NOT_NEGATED}(?:{bounds})\s*{_AMOUNT}(?=\s*{_CURRENCY})|"
+        rf"\b{_PRICE_WORD}\s+(?:\w+\s+)?{_NOT_NEGATED}(?:{bounds})\s*{_AMOUNT}|"
+        rf"\b(?:{price_bounds})\s*\$?\s*{_AMOUNT}",
+        re.IGNORECASE,
+    )
+
+def _parse_amount(text: str) -> int:
+    """Converts a matched amount ("2,000", "1.5k") to an integer."""
+    text = text.replace(",", "").lower()
+    if text.endswith("k"):
+        return round(float(text[:-1]) * 1000)
+    return int(float(text))
+
+MAX_PRICE_RE = _budget_re(
+    r"under|below|less\s+than|up\s+to|до|(?:no|not)\s+(?:more\s+than|over|above)|не\s+(?:более|больше|выше)",
+    r"cheaper\s+than|less\s+expensive\s+than|дешевле|не\s+дороже",
+)
+MIN_PRICE_RE = _budget_re(
+    r"over|above|more\s+than|from|от|(?:no|not)\s+(?:less\s+than|under|below)|не\s+(?:менее|меньше|ниже)",
+    r"more\s+expensive\s+than|(?<!не\s)дороже",
+)
+
+# A brand mentioned in a negated clause ("I don't want Dell", "только не HP") is not a preference.
+NEGATION_RE = re.compile(
+    r"\b(?:not|no|don['’]?t|doesn['’]?t|never|without|except|avoid|не|нет|без|кроме)\b", re.IGNORECASE
+)
+CLAUSE_BREAK_RE = re.compile(r"[.,;:!?]|\b(?:but|however|но|а)\b", re.IGNORECASE)
+
+class PreferenceBatch(BaseModel):
+    """Preferences stated in each of several user messages."""
+    preferences: List[UserPreference] = Field(
+        ...,
+        description="One entry per user message, in the same order as the messages.",
+    )
+
+# Keyword cues per intent. A message whose cues all point to one intent is classified without a
+# model call; messages with no cues or mixed cues ("best one to compare?") go to the model.
+INTENT_KEYWORDS = {
+    Intent.COMPARISON: re.compile(
+        r"\b(?:compare|comparison|vs|versus|which\s+is\s+better|difference|differ)\b|сравн|разниц|чем\s+отлича",
+        re.IGNORECASE,
+    ),
+    Intent.INFORMATION_DETAILS: re.compile(
+        r"\b(?:specs|specifications|details|weight|ports|battery|tell\s+me\s+more)\b|характеристик|подробн|\bвес(?:ит)?\b",
+        re.IGNORECASE,
+    ),
+    Intent.SEARCH_SELECTION: re.compile(
+        r"\bunder\s*\$|\b(?:cheaper|cheapest|best|recommend|looking\s+for)\b|\bищу\b|дешевл|посоветуй|подбери",
+        re.IGNORECASE,
+    ),
+}
+
+def classify_intent_locally(text: str) -> Optional[Intent]:
+    """Returns the intent when keyword cues point to exactly one intent, otherwise None."""
+    matched = [intent for intent, pattern in INTENT_KEYWORDS.items() if pattern.search(text)]
+    return matched[0] if len(matched) == 1 else None
+
+class IntentAndPreferences(BaseModel):
+    """Routes the user to the correct intent and extracts any stated preferences."""
+    intent: Intent = Field(
+        ...,
+        description="The user's primary intent.",
+    )
     preference: UserPreference = Field(
         ...,
         description="The user's preferences.",
     )
 
+# --- Language Detection ---
+def detect_language(text: str, default: Literal["English", "Russian"] = "English") -> Literal["English", "Russian"]:
+    """Detects whether the text is English or Russian from the scripts it uses.
+
+    Russian messages routinely contain Latin product names ("Сравни Dell XPS 13"), while English
+    ones never contain Cyrillic, so any Cyrillic letter marks the message as Russian. Input with no
+    letters at all (e.g. "1500?") keeps `default`, typically the language of the previous turn.
+    """
+    if any("\u0400" <= c <= "\u04FF" for c in text):
+        return "Russian"
+    if any(c.isascii() and c.isalpha() for c in text):
+        return "English"
+    return default
+
 # --- Logging ---
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger.setLevel(logging.WARNING)
 logger.propagate = False
 
-if logger.hasHandlers():
+@st.cache_resource(show_spinner=False)
+def configure_logging() -> logging.Handler:
+    """Attaches the buffered, rotating chatbot.log handler to the advisor logger once per process.
+
+    Records are held in memory and written in batches (immediately for errors), and the file is
+    only opened on the first write, so importing the module touches no files.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        "chatbot.log", maxBytes=5_000_000, backupCount=3, encoding="utf-8", delay=True
+    )
+    file_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    handler = logging.handlers.MemoryHandler(capacity=200, flushLevel=logging.ERROR, target=file_handler)
     logger.handlers.clear()
+    logger.addHandler(handler)
+    return handler
+
+# Only the most recent messages are sent to the model to bound prompt size.
+MAX_HISTORY_MESSAGES = 10
+
+RAG_ERROR_MESSAGE = "Sorry, I encountered an error while processing your request."
+
+def is_error_reply(reply: str) -> bool:
+    """Whether a reply hit the RAG error path. The error message is always the last chunk, possibly
+    after part of an answer that was already streamed, so such replies must not be cached."""
+    return reply.endswith(RAG_ERROR_MESSAGE)
+
+# Similar earlier questions are answered from the semantic cache persisted at this path.
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_PATH = ".semantic_cache"
+# Minimum cosine similarity for a cached answer to be reused; tune it from the logged hit rate.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+SEMANTIC_CACHE_MAX_ENTRIES = 5000
+
+# Search requests with any of these stored filters are answered in one call, with retrieval run up front,
+# as long as the message asks for nothing beyond them (see FILLER_WORDS).
+FUSED_SEARCH_KEYS = ("brand", "max_price", "min_ram_gb")
+# Words that add no search terms of their own. A message made of these plus the locally extracted
+# brand, RAM and budget ("show me Dell laptops under $1500") can be searched with the stored
+# preferences alone; any other word ("gaming", "RTX", "M2", "cheapest") goes through tool selection.
+FILLER_WORDS = frozenset(
+    "show me find search list get give any some all the a an of with and or in for to i im i'm want need "
+    "looking like would please can you do have are there is what which laptop laptops notebook notebooks "
+    "computer computers model models options dollars dollar usd "
+    "покажи покажите найди найдите подбери мне какие какой есть все у вас с со и или в на для я хочу нужен "
+    "нужны ищу пожалуйста можно ноутбук ноутбуки ноутбуков ноутбука модели варианты долларов доллара доллар".split()
+)
+# Preferences the retriever has no filter for (storage, screen, color) must not reach it as arguments.
+SEARCH_PARAMS = frozenset(inspect.signature(ProductRetriever.search_products).parameters) - {"self"}
+
+# Transient errors (rate limits, connection and server errors) are retried by the OpenAI client
+# itself, with exponential backoff and Retry-After; only one retry layer, so a turn can't stall
+# on stacked retries. Input analysis falls back to GENERAL_INQUIRY when they persist.
+TRANSIENT_API_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+MAX_API_RETRIES = 3
+
+# --- Async runtime ---
+T = TypeVar("T")
+
+@st.cache_resource(show_spinner=False)
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Starts a long-lived event loop in a daemon thread.
+
+    Streamlit re-executes this script on every interaction, so the loop (and the HTTP
+    connection pools bound to it) is kept as a cached resource instead of using asyncio.run().
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="advisor-event-loop", daemon=True).start()
+    return loop
+
+@st.cache_resource(show_spinner=False)
+def _get_http_client() -> httpx.AsyncClient:
+    """Returns the HTTP/2 keep-alive pool shared by all OpenAI calls, so TLS handshakes aren't repeated per call."""
+    return DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+        timeout=30.0,
+    )
+
+def run_async(coro: Awaitable[T]) -> T:
+    """Runs a coroutine on the shared event loop and blocks until it completes."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_event_loop()).result()
 
-file_handler = logging.FileHandler("chatbot.log", mode="w")
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+def iterate_async(stream: AsyncIterator[T]) -> Iterator[T]:
+    """Adapts an async iterator running on the shared event loop into a blocking iterator."""
+    while True:
+        try:
+            yield run_async(stream.__anext__())
+        except StopAsyncIteration:
+            return
 
 # --- Pydantic schema for tool calling ---
 class ProductSearchTool(BaseModel):
@@ -89,143 +289,302 @@ class ProductSearchTool(BaseModel):
         None, description="A list of availability statuses (e.g., 'in_stock', 'preorder')."
     )
 
+# Tool definitions are converted once at import and passed to the API as-is.
+SEARCH_TOOL_SCHEMA = {"type": "function", "function": convert_to_openai_function(ProductSearchTool)}
+ANALYSIS_SCHEMA = {"type": "function", "function": convert_to_openai_function(IntentAndPreferences)}
+ROUTER_SCHEMA = {"type": "function", "function": convert_to_openai_function(IntentRouter)}
+
 # --- Core Advisor ---
 class ShoppingAdvisor:
-    def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
-        self.retriever = ProductRetriever()
+    def __init__(
+        self,
+        api_key: str,
+        response_cache: Optional[ResponseCache] = None,
+        semantic_cache: Optional[SemanticCache] = None,
+        retriever: Optional[ProductRetriever] = None,
+        client: Optional[AsyncOpenAI] = None,
+    ):
+        self.client = client if client is not None else AsyncOpenAI(
+            api_key=api_key,
+            http_client=_get_http_client(),
+            max_retries=MAX_API_RETRIES,
+        )
+        self.retriever = retriever if retriever is not None else ProductRetriever()
         self.known_brands = self.retriever.get_all_brands()
-        self.router_schema = convert_to_openai_function(IntentRouter)
-        self.search_tool_schema = convert_to_openai_function(ProductSearchTool)
-        self.preference_extractor_schema = convert_to_openai_function(PreferenceExtractor)
-
-    def _extract_preferences(self, user_input: str) -> Optional[Dict[str, Any]]:
-        """Extracts user preferences from user input using a structured format."""
-        
-        # Create a dynamic system prompt with the list of known brands
-        brands_list = ", ".join(self.known_brands)
-        system_prompt = f"""
-You are a preference spotter. Your task is to identify and extract any product-related preferences the user states.
-
-- **Extract from this list of known brands only**: {brands_list}.
-- Other preferences can include RAM, storage, screen size, price, CPU (Intel, AMD, Apple), GPU, or color.
-- Only extract preferences that are explicitly mentioned.
-"""
-
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_input},
-        ]
-
+        # Brands are matched locally in one pass rather than listed in every analysis prompt.
+        self._brands_by_name = {brand.lower(): brand for brand in self.known_brands}
+        self._brand_re = re.compile(
+            r"\b(" + "|".join(re.escape(brand) for brand in self.known_brands) + r")\b", re.IGNORECASE
+        )
+        # A brand followed by the first word of a catalog model ("HP Envy 15") names a product, not a preference.
+        model_words = sorted({name.split()[0] for name in self.retriever.get_model_names()}, key=len, reverse=True)
+        self._model_word_re = re.compile(
+            r"\s+(?:" + "|".join(re.escape(word) for word in model_words) + r")\b", re.IGNORECASE
+        )
+        self.response_cache = response_cache if response_cache is not None else ResponseCache()
+        self.semantic_cache = semantic_cache
+        self._in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+
+    async def _cached_completion(self, request: Dict[str, Any], parse: Callable[[Any], T]) -> T:
+        """Calls the chat completions API, caching the parsed result of identical temperature-0 requests.
+
+        Only successfully parsed results are stored, so a malformed response is never replayed from the cache.
+        Identical requests made while the first is still running (e.g. the same message from concurrent
+        sessions) share its call instead of each going to the API.
+        """
+        key = self.response_cache.make_key(request["model"], request)
+        cached = self.response_cache.get(key)
+        if cached is not None:
+            return cached
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(self._parsed_completion(request, parse))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        result = await asyncio.shield(task)
+        self.response_cache.set(key, result)
+        return result
+
+    async def _parsed_completion(self, request: Dict[str, Any], parse: Callable[[Any], T]) -> T:
+        return parse(await self.client.chat.completions.create(**request))
+
+    def _extract_local_preferences(self, user_input: str) -> Tuple[Dict[str, Any], str]:
+        """Extracts the brand, RAM and budget preferences that can be read without the model.
+
+        Returns the preferences and the input with the matched phrases removed, so the caller can
+        tell whether anything preference-like is left for the model. A single brand mention is taken
+        as the preferred brand; several brands ("Dell and HP") are a listing, not a preference, and
+        neither is a brand in a negated clause ("not Dell") or as part of a product name ("HP Envy 15").
+        """
+        preferences: Dict[str, Any] = {}
+        brands = set()
+        for match in self._brand_re.finditer(user_input):
+            if self._model_word_re.match(user_input, match.end()):
+                continue
+            clause = CLAUSE_BREAK_RE.split(user_input[:match.start()])[-1]
+            if NEGATION_RE.search(clause):
+                continue
+            brands.add(self._brands_by_name[match.group(1).lower()])
+        if len(brands) == 1:
+            preferences["brand"] = brands.pop()
+        remainder = self._brand_re.sub(" ", user_input)
+
+        for key, pattern in (("min_ram_gb", RAM_PREF_RE), ("max_price", MAX_PRICE_RE), ("min_price", MIN_PRICE_RE)):
+            match = pattern.search(remainder)
+            if match:
+                value = next(group for group in match.groups() if group)
+                preferences[key] = _parse_amount(value)
+                remainder = remainder[:match.start()] + " " + remainder[match.end():]
+
+        return preferences, remainder
+
+    def _asks_only_for_preferences(self, user_input: str) -> bool:
+        """Whether the message holds no search terms beyond the brand, RAM and budget read locally."""
+        _, remainder = self._extract_local_preferences(user_input)
+        return all(word in FILLER_WORDS for word in re.findall(r"[\w']+", remainder.lower()))
+
+    def _stated_preferences(self, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        """Keeps the explicitly stated preferences from a model response, with the brand as spelled in the catalog."""
+        # Filter out any None values to only return explicitly stated preferences
+        preferences = {k: v for k, v in preferences.items() if v is not None}
+        if "brand" in preferences:
+            # Brands outside the catalog would only filter every product out.
+            brand = self._brands_by_name.get(str(preferences.pop("brand")).lower())
+            if brand:
+                preferences["brand"] = brand
+        return preferences
+
+    async def extract_preferences_batch(self, user_inputs: List[str]) -> List[Dict[str, Any]]:
+        """Extracts the preferences stated in each of several user messages with a single call.
+
+        Used to rebuild preferences for a replayed conversation instead of analyzing it turn by turn.
+        Returns one dict per message; if the call fails only the locally extracted preferences are kept.
+        """
+        if not user_inputs:
+            return []
+        local = [self._extract_local_preferences(text)[0] for text in user_inputs]
+        numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(user_inputs, 1))
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.parse(
                 model="gpt-4.1-mini",
-                messages=messages,
-                tools=[{"type": "function", "function": self.preference_extractor_schema}],
-                tool_choice={"type": "function", "function": {"name": "PreferenceExtractor"}},
+                messages=[
+                    {"role": "system", "content": PREFERENCE_BATCH["system_prompt"]},
+                    {"role": "user", "content": numbered},
+                ],
+                response_format=PreferenceBatch,
                 temperature=0.0,
             )
-            tool_call = response.choices[0].message.tool_calls[0]
-            args = json.loads(tool_call.function.arguments)
-            preferences = args.get("preference", {})
-            
-            # Filter out any None values to only return explicitly stated preferences
-            extracted_prefs = {k: v for k, v in preferences.items() if v is not None}
-            
-            if extracted_prefs:
-                logger.info(f"Extracted preferences: {extracted_prefs}")
-                return extracted_prefs
-                
-        except (json.JSONDecodeError, KeyError, ValueError, IndexError, AttributeError) as e:
-            logger.warning(f"Preference extraction failed: {e}")
-            return None
-            
-        return None
+            batch = response.choices[0].message.parsed
+            if batch is None or len(batch.preferences) != len(user_inputs):
+                raise ValueError("expected one preference entry per message")
+        except (openai.OpenAIError, ValidationError, ValueError) as e:
+            logger.warning("Batch preference extraction failed: %s", e)
+            return local
+
+        return [
+            {**local_prefs, **self._stated_preferences(extracted.model_dump())}
+            for extracted, local_prefs in zip(batch.preferences, local)
+        ]
+
+    async def _analyze_input(self, user_input: str) -> Tuple[Intent, Optional[Dict[str, Any]]]:
+        """Determines the user's intent and extracts stated preferences in a single call.
+
+        Brand, RAM and budget preferences are extracted locally first; the model is only asked for
+        preferences when something preference-like remains, and is skipped entirely when keyword
+        cues settle the intent and nothing is left for it to extract. Transient API errors are retried by
+        the client; when they persist, or the response is unparseable, the intent falls back to GENERAL_INQUIRY.
+        """
+        local_prefs, remainder = self._extract_local_preferences(user_input)
+        if PREF_HINT_RE.search(remainder):
+            system_prompt = INPUT_ANALYSIS["system_prompt"]
+            tool = ANALYSIS_SCHEMA
+        else:
+            local_intent = classify_intent_locally(user_input)
+            if local_intent is not None:
+                logger.info("Intent classified locally as: %s", local_intent.value)
+                return local_intent, local_prefs or None
+            # Everything preference-like was extracted locally, so only the intent is requested.
+            system_prompt = INTENT_ROUTING["system_prompt"]
+            tool = ROUTER_SCHEMA
 
-    def _get_intent(self, user_input: str) -> Intent:
-        """Determines the user's intent with up to 5 retries."""
         messages = [
-            {"role": "system", "content": "You are an intent classifier. Your task is to determine the user's primary goal."},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_input},
         ]
-        
-        for i in range(5):
-            try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4.1-mini",
-                    messages=messages,
-                    tools=[{"type": "function", "function": self.router_schema}],
-                    tool_choice={"type": "function", "function": {"name": "IntentRouter"}},
-                    temperature=0.0,
-                )
-                tool_call = response.choices[0].message.tool_calls[0]
-                args = json.loads(tool_call.function.arguments)
-                intent = Intent(args.get("intent"))
-                logger.info(f"Intent classified as: {intent.value}")
-                return intent
-            except (json.JSONDecodeError, KeyError, ValueError, IndexError) as e:
-                logger.warning(f"Intent classification failed on attempt {i+1}: {e}")
-                continue
 
-        logger.warning("Intent classification failed after 5 attempts. Defaulting to GENERAL_INQUIRY.")
-        return Intent.GENERAL_INQUIRY
+        def parse(response: Any) -> Tuple[Intent, Dict[str, Any]]:
+            tool_call = response.choices[0].message.tool_calls[0]
+            args = json.loads(tool_call.function.arguments)
+            intent = Intent(args.get("intent"))
+            return intent, self._stated_preferences(args.get("preference") or {})
 
-    def _get_language(self, user_input: str) -> Literal["English", "Russian"]:
-        """Detects the language of the user's input."""
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a language detector. Determine if the user's message is primarily in English or Russian. Respond with only 'English' or 'Russian'.",
-                    },
-                    {"role": "user", "content": user_input},
-                ],
-                max_tokens=5,
-                temperature=0.0,
+            intent, extracted_prefs = await self._cached_completion(
+                {
+                    "model": "gpt-4.1-mini",
+                    "messages": messages,
+                    "tools": [tool],
+                    "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+                    "temperature": 0.0,
+                },
+                parse,
             )
-            language = response.choices[0].message.content.strip()
-            if language in ["English", "Russian"]:
-                logger.info(f"Language detected: {language}")
-                return language
-        except Exception as e:
-            logger.warning(f"Language detection failed: {e}")
-        
-        return "English"  # Default to English on failure
-
-    def _execute_rag_flow(self, history: List[Dict[str, str]], system_prompt_content: str, preferences: Dict[str, Any], language: str) -> str:
-        """Executes the full retrieval-augmented generation flow."""
+            logger.info("Intent classified as: %s", intent.value)
+            # Local extraction only fills in what the model left out; the model reads the whole sentence.
+            extracted_prefs = {**local_prefs, **extracted_prefs}
+            if extracted_prefs:
+                logger.info("Extracted preferences: %s", extracted_prefs)
+                return intent, extracted_prefs
+            return intent, None
+        except TRANSIENT_API_ERRORS as e:
+            # The client has already retried with backoff (MAX_API_RETRIES).
+            logger.warning("Input analysis failed after retries: %s", e)
+        except (json.JSONDecodeError, KeyError, ValueError, IndexError, AttributeError) as e:
+            # At temperature 0 the same malformed output would just come back again.
+            logger.warning("Input analysis returned an unusable response: %s", e)
+
+        logger.warning("Defaulting to GENERAL_INQUIRY.")
+        return Intent.GENERAL_INQUIRY, local_prefs or None
+
+    async def _stream_final_answer(self, messages: List[Dict[str, Any]]) -> AsyncIterator[str]:
+        """Streams the summary of the retrieved products."""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Messages to LLM (final RAG call):\n%s", json.dumps(messages, indent=2, ensure_ascii=False))
+
+        final_stream = await self.client.chat.completions.create(model="gpt-4.1-mini", messages=messages, temperature=0.0, stream=True)
+        final_parts: List[str] = []
+        async for chunk in final_stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                final_parts.append(delta)
+                yield delta
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Final LLM response: %s", "".join(final_parts))
+
+    async def _execute_rag_flow(
+        self,
+        history: List[Dict[str, str]],
+        system_prompt_content: str,
+        preferences: Dict[str, Any],
+        language: str,
+        intent: Optional[Intent] = None,
+    ) -> AsyncIterator[str]:
+        """Executes the full retrieval-augmented generation flow, streaming the final answer as it is generated.
+
+        The system prompt stays first and the per-turn intent is appended after the history, so the
+        static prefix can be served from the API's prompt cache. A search request whose stored
+        preferences already pin down the filters, and whose message asks for nothing else, skips the
+        tool-selection call: the retriever is queried with the preferences directly and the model
+        only summarizes. Otherwise the model's tool arguments are merged over the preferences.
+        """
         system_prompt = {"role": "system", "content": system_prompt_content}
-        messages: List[Dict[str, Any]] = [system_prompt] + history
-        logger.info("Messages to LLM (RAG flow):\n%s", json.dumps(messages, indent=2))
+        # Tool traffic from earlier turns is stale once summarized, so only plain chat turns are resent.
+        chat_history = [m for m in history if m.get("role") != "tool" and not m.get("tool_calls")]
+        messages: List[Dict[str, Any]] = [system_prompt] + chat_history[-MAX_HISTORY_MESSAGES:]
+        if intent is not None:
+            messages.append({"role": "system", "content": f"Intent: {intent.value}"})
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Messages to LLM (RAG flow):\n%s", json.dumps(messages, indent=2, ensure_ascii=False))
 
         try:
-            first_response = self.client.chat.completions.create(
+            latest_input = next((m.get("content") or "" for m in reversed(chat_history) if m.get("role") == "user"), "")
+            if (
+                intent == Intent.SEARCH_SELECTION
+                and any(preferences.get(k) is not None for k in FUSED_SEARCH_KEYS)
+                and self._asks_only_for_preferences(latest_input)
+            ):
+                search_args = {k: v for k, v in preferences.items() if k in SEARCH_PARAMS}
+                logger.info("Searching directly with preferences: %s", search_args)
+                results = await asyncio.to_thread(self.retriever.search_products, **search_args)
+                products_json = json.dumps(results, ensure_ascii=False, separators=(",", ":"))
+                messages.append({"role": "system", "content": f"Search results (JSON) for the user's preferences: {products_json}"})
+                follow_up = f"Based on the search results (JSON above), write a concise, helpful answer to my last message. Respond in {language}."
+                messages.append({"role": "user", "content": follow_up})
+                async for delta in self._stream_final_answer(messages):
+                    yield delta
+                return
+
+            first_response = await self.client.chat.completions.create(
                 model="gpt-4.1-mini",
                 messages=messages,
-                tools=[{"type": "function", "function": self.search_tool_schema}],
+                tools=[SEARCH_TOOL_SCHEMA],
                 tool_choice="auto",
                 temperature=0.0,
             )
             resp_msg = first_response.choices[0].message
-            logger.info("LLM response (1st RAG call):\n%s", resp_msg.model_dump_json(indent=2))
+            usage = getattr(first_response, "usage", None)
+            if usage is not None and usage.prompt_tokens_details is not None:
+                logger.info(
+                    "Prompt tokens (1st RAG call): %s, cached: %s", usage.prompt_tokens, usage.prompt_tokens_details.cached_tokens
+                )
 
             if getattr(resp_msg, "tool_calls", None):
-                messages.append(resp_msg.model_dump())
+                # Dumped once for both the follow-up request and the log; None fields are dropped.
+                assistant_message = resp_msg.model_dump(exclude_none=True)
+                logger.debug("LLM response (1st RAG call): %s", assistant_message)
+                messages.append(assistant_message)
 
+                search_args: List[Dict[str, Any]] = []
                 for tool_call in resp_msg.tool_calls:
                     args = json.loads(tool_call.function.arguments or "{}")
                     
                     # Merge stored preferences with tool call arguments
-                    merged_args = preferences.copy()
-                    merged_args.update(args)
+                    merged_args = {k: v for k, v in preferences.items() if k in SEARCH_PARAMS}
+                    merged_args.update((k, v) for k, v in args.items() if k in SEARCH_PARAMS)
 
-                    logger.info("Tool call requested: %s with merged args:\n%s", tool_call.function.name, json.dumps(merged_args, indent=2))
-                    
-                    results = self.retriever.search_products(**merged_args)
-                    products_json = json.dumps(results, indent=2, ensure_ascii=False)
-                    logger.info("Retrieved products (JSON) for tool_call %s:\n%s", tool_call.id, products_json)
+                    logger.info("Tool call requested: %s with merged args: %s", tool_call.function.name, merged_args)
+                    search_args.append(merged_args)
+
+                # Retrievals for parallel tool calls (e.g. one per compared product) are independent,
+                # so they run concurrently; gather preserves tool-call order.
+                all_results = await asyncio.gather(
+                    *(asyncio.to_thread(self.retriever.search_products, **merged_args) for merged_args in search_args)
+                )
+
+                for tool_call, results in zip(resp_msg.tool_calls, all_results):
+                    # Compact separators keep the tool payload (and its token count) small.
+                    products_json = json.dumps(results, ensure_ascii=False, separators=(",", ":"))
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Retrieved products (JSON) for tool_call %s:\n%s", tool_call.id, json.dumps(results, indent=2, ensure_ascii=False))
 
                     messages.append({
                         "tool_call_id": tool_call.id,
@@ -236,42 +595,124 @@ You are a preference spotter. Your task is to identify and extract any product-r
                 
                 follow_up = f"Based on the tool results (JSON above), write a concise, helpful summary. Respond in {language}."
                 messages.append({"role": "user", "content": follow_up})
-                
-                logger.info("Messages to LLM (2nd RAG call):\n%s", json.dumps(messages, indent=2))
-
-                final_response = self.client.chat.completions.create(model="gpt-4.1-mini", messages=messages, temperature=0.0)
-                final_content = (final_response.choices[0].message.content or "").strip()
-                logger.info("Final LLM response: %s", final_content)
-                return final_content
+                async for delta in self._stream_final_answer(messages):
+                    yield delta
+                return
 
-            return (resp_msg.content or "").strip()
+            content = (resp_msg.content or "").strip()
+            logger.debug("LLM response (1st RAG call): %s", content)
+            if content:
+                yield content
 
         except Exception as e:
             logger.exception("Error in RAG flow: %s", e)
-            return "Sorry, I encountered an error while processing your request."
-
-    def _handle_comparison(self, history: List[Dict[str, str]], preferences: Dict[str, Any], language: str) -> str:
-        """Handles a product comparison request using the RAG flow."""
-        return self._execute_rag_flow(history, PRODUCT_COMPARISON["system_prompt"], preferences, language)
-
-    def get_response(self, user_input: str, history: List[Dict[str, str]], preferences: Dict[str, Any]) -> str:
-        """Routes the user to a specific handler based on the classified intent."""
+            yield RAG_ERROR_MESSAGE
+
+    async def classify(
+        self, user_input: str, default_language: Literal["English", "Russian"] = "English"
+    ) -> Tuple[str, Intent, Optional[Dict[str, Any]]]:
+        """Detects the language locally and runs the combined intent and preference analysis."""
+        language = detect_language(user_input, default=default_language)
+        logger.info("Language detected: %s", language)
+        intent, preferences = await self._analyze_input(user_input)
+        return language, intent, preferences
+
+    async def stream_response(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]],
+        preferences: Dict[str, Any],
+        language: Optional[str] = None,
+        intent: Optional[Intent] = None,
+    ) -> AsyncIterator[str]:
+        """Routes the user to a specific handler based on the classified intent and streams its reply.
+
+        Callers that already ran `classify` can pass its language and intent to skip reclassification.
+        """
         logger.info("User input: %s", user_input)
-        language = self._get_language(user_input)
-        intent = self._get_intent(user_input)
-        truncated_history = history[-10:]
-
-        if intent == Intent.SEARCH_SELECTION:
-            return self._execute_rag_flow(truncated_history, PRODUCT_SEARCH_SELECTION["system_prompt"], preferences, language)
-        elif intent == Intent.INFORMATION_DETAILS:
-            return self._execute_rag_flow(truncated_history, PRODUCT_INFORMATION_DETAILS["system_prompt"], preferences, language)
-        elif intent == Intent.COMPARISON:
-            return self._execute_rag_flow(truncated_history, PRODUCT_COMPARISON["system_prompt"], preferences, language)
-        else:
-            return self._execute_rag_flow(truncated_history, GENERAL_ASSORTMENT_INQUIRY["system_prompt"], preferences, language)
+        if language is None or intent is None:
+            language, intent, _ = await self.classify(user_input)
+
+        cache_key = embedding = None
+        if self.semantic_cache is not None:
+            # Everything except the query text must match exactly for a cached answer to apply.
+            prior_history = history[:-1] if history and history[-1].get("role") == "user" else history
+            cache_key = ResponseCache.make_key(
+                "answer", {"language": language, "intent": intent.value, "preferences": preferences, "history": prior_history}
+            )
+            try:
+                response = await self.client.embeddings.create(
+                    model=EMBEDDING_MODEL, input=SemanticCache.normalize_query(user_input)
+                )
+                embedding = response.data[0].embedding
+            except openai.OpenAIError as e:
+                logger.warning("Query embedding failed, skipping the semantic cache: %s", e)
+            else:
+                cached = self.semantic_cache.lookup(embedding, cache_key)
+                logger.info(
+                    "Semantic cache %s; hit rate %.0f%% over %d lookups",
+                    "hit" if cached is not None else "miss",
+                    100 * self.semantic_cache.hit_rate,
+                    self.semantic_cache.hits + self.semantic_cache.misses,
+                )
+                if cached is not None:
+                    yield cached
+                    return
+
+        parts: List[str] = []
+        async for chunk in self._execute_rag_flow(history, SHOPPING_ASSISTANT["system_prompt"], preferences, language, intent):
+            parts.append(chunk)
+            yield chunk
+
+        reply = "".join(parts)
+        if embedding is not None and reply and not is_error_reply(reply):
+            self.semantic_cache.add(user_input, embedding, cache_key, reply)
+            # Writing the cache files blocks, so it runs off the event loop shared by all sessions,
+            # and only every few new answers rather than on each one.
+            if self.semantic_cache.save_due:
+                await asyncio.to_thread(self.semantic_cache.save)
+
+    async def get_response(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]],
+        preferences: Dict[str, Any],
+        language: Optional[str] = None,
+        intent: Optional[Intent] = None,
+    ) -> str:
+        """Returns the complete reply for callers that don't render a stream."""
+        chunks = [chunk async for chunk in self.stream_response(user_input, history, preferences, language, intent)]
+        return "".join(chunks)
+
+    def get_response_sync(
+        self,
+        user_input: str,
+        history: List[Dict[str, str]],
+        preferences: Dict[str, Any],
+        language: Optional[str] = None,
+        intent: Optional[Intent] = None,
+    ) -> str:
+        """Blocking wrapper around `get_response` for synchronous callers such as scripts."""
+        return run_async(self.get_response(user_input, history, preferences, language, intent))
+
+@st.cache_resource(show_spinner=False)
+def get_retriever() -> ProductRetriever:
+    """Loads the product catalog once per process; it doesn't depend on the API key."""
+    return ProductRetriever()
+
+@st.cache_resource(show_spinner=False)
+def get_advisor(api_key: str) -> ShoppingAdvisor:
+    """Builds the advisor once and reuses it (client, retriever, caches) across Streamlit reruns."""
+    semantic_cache = SemanticCache(
+        SEMANTIC_CACHE_PATH, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES
+    )
+    # Answers added since the last periodic save are written on a normal exit.
+    atexit.register(semantic_cache.save)
+    return ShoppingAdvisor(api_key=api_key, semantic_cache=semantic_cache, retriever=get_retriever())
 
 def main():
     st.set_page_config(page_title="Future Tech - Shopping Assistant", page_icon="🛍️")
+    configure_logging()
     st.title("🛍️ Future Tech — Shopping Assistant")
 
     api_key = st.session_state.get("openai_api_key")
@@ -289,8 +730,6 @@ def main():
     
     if "messages" not in st.session_state:
         st.session_state.messages = []
-    if "preferences" not in st.session_state:
-        st.session_state.preferences = {}
 
     st.markdown("Welcome! How can I help you choose a laptop today? / Добро пожаловать! Чем я могу помочь вам в выборе ноутбука сегодня?")
 
@@ -298,7 +737,14 @@ def main():
         with st.chat_message(m["role"]):
             st.markdown(m["content"])
 
-    advisor = ShoppingAdvisor(api_key=api_key)
+    advisor = get_advisor(api_key)
+
+    if "preferences" not in st.session_state:
+        # A conversation restored without its preferences gets them back from one batched call.
+        st.session_state.preferences = {}
+        user_turns = [m["content"] for m in st.session_state.messages if m["role"] == "user"]
+        for turn_preferences in run_async(advisor.extract_preferences_batch(user_turns)):
+            st.session_state.preferences.update(turn_preferences)
 
     prompt = st.chat_input("Type your message... / Введите ваше сообщение...")
     if prompt:
@@ -306,7 +752,10 @@ def main():
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        new_preferences = advisor._extract_preferences(prompt)
+        language, intent, new_preferences = run_async(
+            advisor.classify(prompt, default_language=st.session_state.get("language", "English"))
+        )
+        st.session_state.language = language
         if new_preferences:
             st.session_state.preferences.update(new_preferences)
             pref_list = [f"**{k.replace('_', ' ').title()}**: {v}" for k, v in new_preferences.items()]
@@ -314,10 +763,11 @@ def main():
 
         history = st.session_state.get("messages", [])
         preferences = st.session_state.get("preferences", {})
-        reply = advisor.get_response(prompt, history, preferences)
-        st.session_state.messages.append({"role": "assistant", "content": reply})
         with st.chat_message("assistant"):
-            st.markdown(reply)
+            reply = st.write_stream(
+                iterate_async(advisor.stream_response(prompt, history, preferences, language=language, intent=intent))
+            )
+        st.session_state.messages.append({"role": "assistant", "content": reply})
 
     if st.button("Clear chat / Очистить чат", type="secondary"):
         st.session_state.messages = []
@@ -0,0 +1,204 @@
+"""
+This file contains caches for LLM responses used by the shopping assistant.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Exact-match LRU cache for deterministic (temperature=0) LLM calls."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+
+    @staticmethod
+    def make_key(model: str, payload: Any) -> str:
+        """Builds a cache key from the model name and a hash of the request payload."""
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.blake2b(serialized.encode("utf-8"), digest_size=16).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value for `key`, or None on a miss."""
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def set(self, key: str, value: Any) -> None:
+        """Stores `value`, evicting the least recently used entry when full."""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SemanticCache:
+    """Answer cache that matches new queries to earlier ones by embedding similarity.
+
+    Entries are only reused when their `key` (language, intent, preferences and prior
+    conversation) matches exactly, so a similar question asked in a different context misses.
+    When full, the least recently used entry is evicted. Hits and misses are counted so the
+    threshold can be tuned from the hit rate. Embeddings live in one array preallocated for
+    `max_entries` rows; a new entry fills the next free row or overwrites the evicted one in place.
+
+    With a `path`, the cache is loaded on creation and written by `save`, which callers on an
+    event loop should run in a worker thread, and only once `save_due` says enough has changed.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        threshold: float = 0.93,
+        max_entries: int = 5000,
+        save_every: int = 20,
+        save_interval: float = 60.0,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.save_every = save_every
+        self.save_interval = save_interval
+        # Row i holds the embedding of self._entries[i]; rows past len(self._entries) are unused.
+        self._embeddings: Optional[np.ndarray] = None
+        self._entries: List[Dict[str, Any]] = []
+        self._clock = 0
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        # Guards the entries against `save` copying them from another thread mid-update.
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        if self.path is not None:
+            self._load()
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache so far."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _touch(self, index: int) -> None:
+        self._clock += 1
+        self._entries[index]["last_used"] = self._clock
+
+    @staticmethod
+    def normalize_query(text: str) -> str:
+        """Lowercases and collapses whitespace so trivial variations embed identically."""
+        return " ".join(text.lower().split())
+
+    @staticmethod
+    def _unit(embedding: Any) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: Any, key: str) -> Optional[str]:
+        """Returns the cached response for the most similar query with the same key, if similar enough."""
+        candidates = [i for i, entry in enumerate(self._entries) if entry["key"] == key]
+        if candidates:
+            scores = self._embeddings[candidates] @ self._unit(embedding)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                self.hits += 1
+                self._touch(candidates[best])
+                return self._entries[candidates[best]]["response"]
+        self.misses += 1
+        return None
+
+    def add(self, query: str, embedding: Any, key: str, response: str) -> None:
+        """Stores a response in memory; `save` persists it."""
+        row = self._unit(embedding)
+        entry = {"query": query, "key": key, "response": response}
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = np.zeros((self.max_entries, row.size), dtype=np.float32)
+            if len(self._entries) < self.max_entries:
+                index = len(self._entries)
+                self._entries.append(entry)
+            else:
+                index = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self._entries[index] = entry
+            self._embeddings[index] = row
+            self._touch(index)
+            self._unsaved += 1
+
+    @property
+    def save_due(self) -> bool:
+        """Whether `save_every` entries were added, or any entry was added `save_interval` seconds ago or more."""
+        return self._unsaved >= self.save_every or (
+            self._unsaved > 0 and time.monotonic() - self._last_save >= self.save_interval
+        )
+
+    def save(self) -> None:
+        """Writes the cache to its path, if it has one. Blocking file I/O, safe to run in a worker thread.
+
+        Each file is written to a temporary file and moved into place, so a crash never leaves a
+        truncated file behind.
+        """
+        if self.path is None or self._embeddings is None:
+            return
+        with self._lock:
+            embeddings = self._embeddings[:len(self._entries)].copy()
+            entries = [dict(entry) for entry in self._entries]
+            self._unsaved = 0
+            self._last_save = time.monotonic()
+        with self._save_lock:
+            self._replace(self.path.with_suffix(".npy"), lambda f: np.save(f, embeddings))
+            self._replace(
+                self.path.with_suffix(".json"), lambda f: f.write(json.dumps(entries, ensure_ascii=False).encode("utf-8"))
+            )
+
+    @staticmethod
+    def _replace(target: Path, write: Callable[[Any], Any]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp, target)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _load(self) -> None:
+        embeddings_path, entries_path = self.path.with_suffix(".npy"), self.path.with_suffix(".json")
+        if not (embeddings_path.exists() and entries_path.exists()):
+            return
+        try:
+            embeddings = np.load(embeddings_path)
+            with open(entries_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if embeddings.ndim != 2 or len(embeddings) != len(entries):
+                raise ValueError(f"{len(embeddings)} embeddings for {len(entries)} entries")
+        except (OSError, ValueError) as e:
+            # A truncated or mismatched pair of files only costs the cached answers.
+            logger.warning("Ignoring semantic cache at %s: %s", self.path, e)
+            return
+        if len(entries) > self.max_entries:
+            recent = sorted(range(len(entries)), key=lambda i: entries[i].get("last_used", 0))[-self.max_entries:]
+            embeddings, entries = embeddings[recent], [entries[i] for i in recent]
+        self._embeddings = np.zeros((self.max_entries, embeddings.shape[1]), dtype=np.float32)
+        self._embeddings[:len(entries)] = embeddings
+        self._entries = entries
+        self._clock = max((entry.get("last_used", 0) for entry in self._entries), default=0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
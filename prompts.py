@@ -98,3 +98,65 @@ available products.
         {"role": "assistant", "tool_calls": "[... tool call with brand='Dell' ...]" },
     ],
 }
+
+
+# 5. Input Analysis
+# Description: Prompts for classifying the user's intent and spotting stated preferences.
+# They share one set of preference guidelines, so the analyzers never drift apart.
+PREFERENCE_GUIDELINES = """
+- The brand is the laptop manufacturer, not the CPU or GPU maker.
+- Other preferences can include RAM, storage, screen size, price, CPU (Intel, AMD, Apple), GPU, or color.
+- Only extract preferences that are explicitly mentioned.
+"""
+
+INTENT_ROUTING = {
+    "system_prompt": "You are an intent classifier. Your task is to determine the user's primary goal.",
+}
+
+INPUT_ANALYSIS = {
+    "system_prompt": """
+You are an intent classifier and preference spotter. Your task is to determine the user's primary goal
+and to identify and extract any product-related preferences the user states.
+""" + PREFERENCE_GUIDELINES,
+}
+
+PREFERENCE_BATCH = {
+    "system_prompt": """
+You are a preference spotter. For each of the numbered user messages, extract the product-related
+preferences the user explicitly states in that message, and return exactly one entry per message,
+in order.
+""" + PREFERENCE_GUIDELINES,
+}
+
+
+# 6. Unified Shopping Assistant
+# Description: One static prompt covering all of the intents above. It is sent first and
+# unchanged on every turn, so the prompt prefix can be served from the API's prompt cache;
+# the classified intent follows the conversation as a short trailing message.
+_INTENT_PROMPTS = {
+    "product_search_selection": PRODUCT_SEARCH_SELECTION,
+    "product_information_details": PRODUCT_INFORMATION_DETAILS,
+    "product_comparison": PRODUCT_COMPARISON,
+    "general_assortment_inquiry": GENERAL_ASSORTMENT_INQUIRY,
+}
+
+def _format_examples(examples):
+    """Renders few-shot example turns as plain text for inclusion in a system prompt."""
+    lines = []
+    for turn in examples:
+        speaker = "User" if turn["role"] == "user" else "Assistant"
+        lines.append(f"{speaker}: {turn.get('content') or turn.get('tool_calls')}")
+    return "\n".join(lines)
+
+# The few-shot examples are part of the static text too: they make the instructions concrete
+# and keep the cacheable prefix above the 1024-token minimum for automatic prompt caching.
+SHOPPING_ASSISTANT = {
+    "system_prompt": """
+You are a shopping assistant for a laptop store. A system message after the conversation names
+the user's intent; follow the instructions for that intent below. If no intent is given,
+use the instructions for `general_assortment_inquiry`.
+""" + "".join(
+        f"\n## Intent: {intent}\n{prompt['system_prompt'].strip()}\n\nExamples:\n{_format_examples(prompt['examples'])}\n"
+        for intent, prompt in _INTENT_PROMPTS.items()
+    ),
+}
@@ -6,7 +6,8 @@ Key improvements:
 - Filters at the VARIANT level (brand/price/RAM/CPU/GPU live on variants).
 - Brand-only and price-only searches work.
 - max_price is inclusive (≤), e.g., "under 1500" returns 1499 items.
-- Free-text `query` is a SOFT scorer (ranks) rather than a hard filter.
+- Free-text `query` is a SOFT scorer (ranks) rather than a hard filter; product names, aliases
+  and keywords are matched typo-tolerantly ("ThinkBok Pro", "Макбук Эйр 13").
 - Sensible availability defaults (in_stock, limited, preorder).
 - Gentle fallback: relax price by +10% if nothing found (keeps brand/availability).
 
@@ -19,17 +20,53 @@ Usage:
 
 from __future__ import annotations
 
+import hashlib
 import json
+import logging
+import pickle
+import sys
+from functools import lru_cache
 from dataclasses import dataclass, asdict
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any, Tuple
 from pathlib import Path
 
+import numpy as np
+from rapidfuzz import fuzz, process, utils
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; the NumPy filter below is used without it
+    njit = None
+
 
 DATA_PATH = Path(__file__).with_name("products.json")
 
+logger = logging.getLogger(__name__)
+
+# Default availability: items a user can realistically buy soon
+DEFAULT_AVAILABILITY = frozenset(("in_stock", "limited", "preorder"))
+
+# Bumped whenever the pickled retriever state changes shape in a way the source hash can't see.
+SNAPSHOT_FORMAT = 1
+
+# Lookup tables for string filters are memoized per filter value, up to this many.
+MAX_CACHED_FILTERS = 256
+
+# Minimum fuzz.ratio for a misspelled brand ("Lenova") to resolve to a catalog brand.
+BRAND_FUZZY_CUTOFF = 80
+
+# Minimum fuzz.ratio between the query and a product name, alias or keyword to count as a match.
+QUERY_FUZZY_CUTOFF = 85
+
 
 @dataclass
 class VariantRow:
+    # Slots keep the per-row footprint small and construction cheap (no per-instance __dict__).
+    __slots__ = (
+        "product_id", "brand", "model", "category", "sku", "ram_gb", "storage_gb", "storage_type",
+        "weight_kg", "cpu", "gpu", "screen_inch", "price_usd", "availability", "color",
+    )
+
     product_id: str
     brand: str
     model: str
@@ -53,40 +90,214 @@ def _norm(s: Optional[str]) -> str:
 
 def _flatten(products: List[Dict[str, Any]]) -> List[VariantRow]:
     rows: List[VariantRow] = []
+    # Low-cardinality strings are interned so all rows share one object per distinct value.
+    intern = sys.intern
     for p in products:
         for v in p.get("variants", []):
             rows.append(
                 VariantRow(
                     product_id=p["id"],
-                    brand=p["brand"],
+                    brand=intern(p["brand"]),
                     model=p["model"],
-                    category=p.get("category", ""),
+                    category=intern(p.get("category", "")),
                     sku=v["sku"],
                     ram_gb=v.get("ram_gb"),
                     storage_gb=v.get("storage_gb"),
-                    storage_type=v.get("storage_type", ""),
+                    storage_type=intern(v.get("storage_type", "")),
                     weight_kg=v.get("weight_kg"),
-                    cpu=v.get("cpu", ""),
-                    gpu=v.get("gpu", ""),
+                    cpu=intern(v.get("cpu", "")),
+                    gpu=intern(v.get("gpu", "")),
                     screen_inch=v.get("screen_inch"),
                     price_usd=float(v.get("price_usd")),
-                    availability=v.get("availability", ""),
-                    color=v.get("color", ""),
+                    availability=intern(v.get("availability", "")),
+                    color=intern(v.get("color", "")),
                 )
             )
     return rows
 
 
+def _encode(values: List[str]) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Encodes normalized strings as integer codes; returns the codes and the value -> code vocabulary."""
+    vocab: Dict[str, int] = {}
+    codes = [vocab.setdefault(sys.intern(_norm(v)), len(vocab)) for v in values]
+    # Columns like CPU or availability have a handful of values, so codes are usually one byte.
+    return np.array(codes, dtype=np.min_scalar_type(max(len(vocab) - 1, 0))), vocab
+
+
+@lru_cache(maxsize=256)
+def _resolve_brand(brand: str, choices: Tuple[str, ...]) -> Optional[str]:
+    """Maps a requested brand to the closest normalized catalog brand, or None if nothing is close."""
+    b = _norm(brand)
+    if b in choices:
+        return b
+    match = process.extractOne(b, choices, scorer=fuzz.ratio, score_cutoff=BRAND_FUZZY_CUTOFF)
+    return match[0] if match else None
+
+
+def _allowed_codes(vocab: Dict[str, int], keep: Callable[[str], bool]) -> np.ndarray:
+    """Lookup table over codes: True for the categorical values that satisfy `keep` (evaluated once per value)."""
+    allowed = np.zeros(len(vocab), dtype=bool)
+    allowed[[c for v, c in vocab.items() if keep(v)]] = True
+    return allowed
+
+
+def _dense_rank(keys: List[Tuple[Any, ...]]) -> np.ndarray:
+    """Position of each key in sorted order; equal keys share a rank."""
+    position = {k: r for r, k in enumerate(sorted(set(keys)))}
+    return np.fromiter((position[k] for k in keys), dtype=np.int32, count=len(keys))
+
+
+_EMPTY_INDEX = np.empty(0, dtype=np.intp)
+
+
+# Core filter over the numeric/code columns; min/max price are inclusive. `allow` is the
+# availability lookup table from _allowed_codes. Returns positions into the given arrays.
+def _filter_rows_numpy(price, ram, avail_code, min_price, max_price, min_ram, allow):
+    mask = allow[avail_code] & (price >= min_price) & (price <= max_price) & (ram >= min_ram)
+    return np.flatnonzero(mask)
+
+
+if njit is not None:
+    # Compiled eagerly at import (and cached on disk) so no query pays the JIT cost.
+    # One signature per code width _encode can produce.
+    @njit([f"intp[:](float64[:], int16[:], {code}[:], float64, float64, int64, boolean[:])"
+           for code in ("uint8", "uint16", "uint32")],
+          cache=True, boundscheck=False)
+    def _filter_rows_jit(price, ram, avail_code, min_price, max_price, min_ram, allow):
+        out = np.empty(price.shape[0], dtype=np.intp)
+        n = 0
+        for i in range(price.shape[0]):
+            if allow[avail_code[i]] and min_price <= price[i] <= max_price and ram[i] >= min_ram:
+                out[n] = i
+                n += 1
+        return out[:n]
+
+    _filter_rows = _filter_rows_jit
+else:
+    _filter_rows = _filter_rows_numpy
+
+
 class ProductRetriever:
-    def __init__(self, data_path: Optional[str] = None):
+    def __init__(self, data_path: Optional[str] = None, use_snapshot: bool = True):
         path = Path(data_path) if data_path else DATA_PATH
-        with open(path, "r", encoding="utf-8") as f:
-            products = json.load(f)
+        # The flattened rows and indexes are pickled next to the catalog ("products.snap") and
+        # reused while its header matches the snapshot format, this module's source and the catalog.
+        snapshot = path.with_suffix(".snap")
+        with open(path, "rb") as f:
+            source = f.read()
+        header = self._snapshot_header(source)
+        if use_snapshot and self._load_snapshot(snapshot, header):
+            return
+        self._build(json.loads(source))
+        if use_snapshot:
+            self._save_snapshot(snapshot, header)
+
+    @staticmethod
+    def _snapshot_header(catalog: bytes) -> Dict[str, Any]:
+        return {
+            "format": SNAPSHOT_FORMAT,
+            "module": hashlib.blake2b(Path(__file__).read_bytes(), digest_size=16).hexdigest(),
+            "catalog_size": len(catalog),
+            "catalog": hashlib.blake2b(catalog, digest_size=16).hexdigest(),
+        }
+
+    def _load_snapshot(self, snapshot: Path, header: Dict[str, Any]) -> bool:
+        try:
+            with open(snapshot, "rb") as f:
+                # The header is checked before the state is unpickled, so a snapshot from another
+                # code version or catalog is rebuilt instead of loaded with stale columns.
+                if pickle.load(f) != header:
+                    return False
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:  # a corrupt or incompatible snapshot is simply rebuilt
+            logger.warning("Ignoring catalog snapshot %s: %s", snapshot, e)
+            return False
+        self.__dict__.update(state)
+        self._filter_tables = {}
+        return True
+
+    def _save_snapshot(self, snapshot: Path, header: Dict[str, Any]) -> None:
+        state = {k: v for k, v in self.__dict__.items() if k != "_filter_tables"}
+        try:
+            with open(snapshot, "wb") as f:
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError as e:
+            logger.warning("Could not write catalog snapshot %s: %s", snapshot, e)
+
+    def _build(self, products: List[Dict[str, Any]]) -> None:
         self.rows: List[VariantRow] = _flatten(products)
 
-    def get_all_brands(self) -> List[str]:
-        """Returns a sorted list of unique brand names."""
-        return sorted(list(set(r.brand for r in self.rows)))
+        # Every name a product goes by, preprocessed once and matched against the query in one batch call.
+        product_index = {p["id"]: k for k, p in enumerate(products)}
+        self._row_product = np.array([product_index[r.product_id] for r in self.rows], dtype=np.int32)
+        self._n_products = len(products)
+        self._choices: List[str] = []
+        self._choice_product: List[int] = []
+        for k, p in enumerate(products):
+            for name in [f"{p['brand']} {p['model']}", *p.get("aliases", []), *p.get("keywords", [])]:
+                self._choices.append(utils.default_process(name))
+                self._choice_product.append(k)
+        self._brands: Tuple[str, ...] = tuple(sorted(set(r.brand for r in self.rows)))
+
+        # Filter columns as contiguous arrays (strings as categorical codes), so every filter is one
+        # vectorized mask over all variants instead of a Python loop.
+        self._price = np.array([r.price_usd for r in self.rows], dtype=np.float64)
+        self._ram = np.array([r.ram_gb for r in self.rows], dtype=np.int16)
+        self._storage = np.array([r.storage_gb for r in self.rows], dtype=np.int32)
+        self._brand_code, self._brand_vocab = _encode([r.brand for r in self.rows])
+        self._brand_choices: Tuple[str, ...] = tuple(sorted(self._brand_vocab))
+        self._avail_code, self._avail_vocab = _encode([r.availability for r in self.rows])
+        self._category_code, self._category_vocab = _encode([r.category for r in self.rows])
+        self._cpu_code, self._cpu_vocab = _encode([r.cpu for r in self.rows])
+        self._gpu_code, self._gpu_vocab = _encode([r.gpu for r in self.rows])
+        self._default_allow = _allowed_codes(self._avail_vocab, DEFAULT_AVAILABILITY.__contains__)
+        self._filter_tables: Dict[Tuple[str, Any], np.ndarray] = {}
+        # Inverted indexes: brand and category filters start from their rows instead of scanning all.
+        self._by_brand = {c: np.flatnonzero(self._brand_code == c) for c in self._brand_vocab.values()}
+        self._by_category = {c: np.flatnonzero(self._category_code == c) for c in self._category_vocab.values()}
+        # Output dicts are built once; results are shallow copies (all values are immutable scalars).
+        self._row_dicts = [asdict(r) for r in self.rows]
+        self._haystacks = [utils.default_process(f"{r.brand} {r.model} {r.sku}") for r in self.rows]
+        # Price sort orders (ties broken by brand, model, RAM) as integer ranks, so sorting is a NumPy argsort.
+        self._price_asc_rank = _dense_rank([(r.price_usd, r.brand, r.model, r.ram_gb) for r in self.rows])
+        self._price_desc_rank = _dense_rank([(-r.price_usd, r.brand, r.model, r.ram_gb) for r in self.rows])
+
+    def _filter(self, seed: Optional[np.ndarray], min_price: float, max_price: float, min_ram: int, allow: np.ndarray) -> np.ndarray:
+        """Row indices passing the core filters, within `seed` (sorted row indices) if given."""
+        if seed is None:
+            return _filter_rows(self._price, self._ram, self._avail_code, min_price, max_price, min_ram, allow)
+        keep = _filter_rows(self._price[seed], self._ram[seed], self._avail_code[seed], min_price, max_price, min_ram, allow)
+        return seed[keep]
+
+    @staticmethod
+    def _top(idx: np.ndarray, rank: np.ndarray, limit: int) -> np.ndarray:
+        """`idx` stably sorted by `rank`; when `limit` is smaller, only rows that can reach the first `limit` are kept."""
+        keys = rank[idx]
+        if 0 < limit < idx.size:
+            # O(N) selection of the limit-th key; ties at the cutoff stay so the stable order is exact.
+            within = keys <= np.partition(keys, limit - 1)[limit - 1]
+            idx, keys = idx[within], keys[within]
+        return idx[np.argsort(keys, kind="stable")]
+
+    def _filter_table(self, key: Tuple[str, Any], vocab: Dict[str, int], keep: Callable[[str], bool]) -> np.ndarray:
+        """Returns the code lookup table for a string filter, building it only the first time `key` is seen."""
+        table = self._filter_tables.get(key)
+        if table is None:
+            if len(self._filter_tables) >= MAX_CACHED_FILTERS:
+                self._filter_tables.clear()
+            table = self._filter_tables[key] = _allowed_codes(vocab, keep)
+        return table
+
+    def get_all_brands(self) -> Tuple[str, ...]:
+        """Returns the sorted unique brand names (computed once, immutable)."""
+        return self._brands
+
+    def get_model_names(self) -> Tuple[str, ...]:
+        """Returns the sorted unique model names ("XPS 13", "Envy 15")."""
+        return tuple(sorted({r.model for r in self.rows}))
 
     def search_products(
         self,
@@ -102,80 +313,79 @@ class ProductRetriever:
         limit: int = 12,
         sort_by: str = "relevance",  # "price_asc" | "price_desc"
     ) -> List[Dict[str, Any]]:
-        rows = list(self.rows)
-
-        # Default availability: items a user can realistically buy soon
         if availability is None:
-            availability = ["in_stock", "limited", "preorder"]
-        allow = {a.lower() for a in availability}
-        rows = [r for r in rows if _norm(r.availability) in allow]
-
-        if category:
-            rows = [r for r in rows if _norm(r.category) == _norm(category)]
-
+            allow = self._default_allow
+        else:
+            allowed = frozenset(a.lower() for a in availability)
+            allow = self._filter_table(("availability", allowed), self._avail_vocab, allowed.__contains__)
+        brand_rows = None
         if brand:
-            b = _norm(brand)
-            rows = [r for r in rows if _norm(r.brand) == b]
+            brand_c = self._brand_vocab.get(_resolve_brand(brand, self._brand_choices))
+            brand_rows = self._by_brand.get(brand_c, _EMPTY_INDEX)
+        seed = brand_rows
+        if category:
+            category_rows = self._by_category.get(self._category_vocab.get(_norm(category)), _EMPTY_INDEX)
+            seed = category_rows if seed is None else np.intersect1d(seed, category_rows, assume_unique=True)
 
-        if min_price is not None:
-            rows = [r for r in rows if r.price_usd >= float(min_price)]
-        if max_price is not None:
+        idx = self._filter(
+            seed,
+            -np.inf if min_price is None else float(min_price),
             # inclusive: "under 1500" returns 1499 etc.
-            rows = [r for r in rows if r.price_usd <= float(max_price)]
-
-        if min_ram_gb is not None:
-            rows = [r for r in rows if r.ram_gb >= int(min_ram_gb)]
+            np.inf if max_price is None else float(max_price),
+            -1 if min_ram_gb is None else int(min_ram_gb),
+            allow,
+        )
 
+        # CPU and GPU filters are and-ed into one mask over the surviving rows, compacted once.
+        keep: Optional[np.ndarray] = None
         if cpu_brand:
             cb = _norm(cpu_brand)
-            rows = [r for r in rows if cb in _norm(r.cpu)]
+            keep = self._filter_table(("cpu", cb), self._cpu_vocab, lambda v: cb in v)[self._cpu_code[idx]]
 
         if gpu:
             g = _norm(gpu)
             if g in ("rtx", "nvidia", "discrete", "dedicated"):
-                rows = [r for r in rows if _norm(r.gpu) and _norm(r.gpu) != "integrated"]
+                gpu_allowed = self._filter_table(("gpu", g), self._gpu_vocab, lambda v: bool(v) and v != "integrated")
+            else:
+                gpu_allowed = self._filter_table(("gpu", g), self._gpu_vocab, lambda v: g in v)
+            gpu_keep = gpu_allowed[self._gpu_code[idx]]
+            if keep is None:
+                keep = gpu_keep
             else:
-                rows = [r for r in rows if g in _norm(r.gpu)]
+                keep &= gpu_keep
+
+        if keep is not None:
+            idx = idx[keep]
 
         # Free-text query as a *soft* scorer (no hard filtering)
-        if query:
-            q = _norm(query)
-
-            def score(r: VariantRow) -> int:
-                s = 0
-                tokens = [q] + q.split()
-                hay = f"{r.brand} {r.model} {r.sku}".lower()
-                for t in tokens:
-                    if t and t in hay:
-                        s += 1
-                return s
-
-            rows_scored = [(score(r), r) for r in rows]
+        if query and idx.size:
+            q = utils.default_process(query)
+            # Substring similarity to each variant's "brand model sku", in one native batch call.
+            scores = process.cdist([q], [self._haystacks[i] for i in idx], scorer=fuzz.partial_ratio, processor=None)[0]
+            # A product matched by name, alias or keyword ranks above mere substring matches.
+            matches = process.extract(q, self._choices, scorer=fuzz.ratio, score_cutoff=QUERY_FUZZY_CUTOFF, limit=None)
+            name_match = np.zeros(self._n_products, dtype=bool)
+            name_match[[self._choice_product[j] for _, _, j in matches]] = True
+            scores = scores + 100.0 * name_match[self._row_product[idx]]
             # Keep all rows, but rank by score desc then price asc
-            rows = [r for _, r in sorted(rows_scored, key=lambda x: (-x[0], x[1].price_usd))]
+            idx = idx[np.lexsort((self._price[idx], -scores))]
 
         # Sorting
         if sort_by == "price_asc":
-            rows.sort(key=lambda r: (r.price_usd, r.brand, r.model, r.ram_gb))
+            idx = self._top(idx, self._price_asc_rank, limit)
         elif sort_by == "price_desc":
-            rows.sort(key=lambda r: (-r.price_usd, r.brand, r.model, r.ram_gb))
-
-        # Fallback: nothing found → relax price by +10% (keep brand & availability)
-        if not rows:
-            expanded = list(self.rows)
-            expanded = [r for r in expanded if _norm(r.availability) in allow]
-            if brand:
-                expanded = [r for r in expanded if _norm(r.brand) == _norm(brand)]
-            if max_price is not None:
-                cap = float(max_price) * 1.10
-                expanded = [r for r in expanded if r.price_usd <= cap]
-            rows = expanded
+            idx = self._top(idx, self._price_desc_rank, limit)
+
+        idx = idx.tolist()
+
+        # Fallback: nothing found → relax price by +10% (keep brand & availability).
+        # Reuses the brand index and availability table of the strict pass; only the price bound changes.
+        if not idx:
+            cap = np.inf if max_price is None else float(max_price) * 1.10
+            idx = self._filter(brand_rows, -np.inf, cap, -1, allow).tolist()
 
         # Format output
-        out: List[Dict[str, Any]] = []
-        for r in rows[:limit]:
-            out.append(asdict(r))
-        return out
+        return [dict(self._row_dicts[i]) for i in idx[:limit]]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,532 @@
+"""
+Shared runner for the end-to-end scenario scripts (test_scenarios_eng.py, test_scenarios_ru.py).
+
+Each script defines its scenarios and the evaluator prompts in its own language and calls `main`.
+The runner plays every scenario against ShoppingAdvisor and asks an LLM judge (gpt-4o-mini with a
+structured verdict) whether each response meets the step's expected outcome.
+"""
+
+import os
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import httpx
+from openai import DefaultHttpxClient, OpenAI
+
+# Add the parent directory to the path so we can import advisor
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from advisor import ShoppingAdvisor, Intent, is_error_reply, run_async
+from cache import ResponseCache
+
+# Seconds between status checks of an evaluation batch (--batch mode)
+BATCH_POLL_SECONDS = 30
+
+# Judge model and its answer format: a boolean verdict enforced by a JSON schema instead of free text
+EVALUATOR_MODEL = "gpt-4o-mini"
+VERDICT_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "verdict",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"passed": {"type": "boolean"}},
+            "required": ["passed"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# How many earlier conversation messages the evaluator sees (besides the response being judged)
+EVALUATOR_HISTORY_MESSAGES = 4
+
+# Concrete values in an expected outcome that can be checked without the LLM: quoted model names,
+# prices and memory/storage sizes
+REQUIRED_VALUE_RE = re.compile(r"['‘]([^'’]+)['’]|(\$\d[\d,]*)|(\d+\s?(?:GB|TB|ГБ|ТБ))", re.IGNORECASE)
+# Expectations with constraints ("not", "only", "under", …) cannot be checked by looking for values
+CONSTRAINT_RE = re.compile(r"\b(?:not|non|no|only|under|over|не|нет|только|менее|более)\b", re.IGNORECASE)
+# Expectations about the quality of the answer (a comparison, a recommendation, an explanation, a
+# focus) need the evaluator even when every named value is mentioned; only plain listings pass locally
+QUALITATIVE_RE = re.compile(
+    r"compar|recommend|explain|focus|identif|acknowledg|detail|correct|applying|"
+    r"сравн|рекоменд|посовет|объясн|фокус|акцент|определ|подтверд|подробн|правильн|учитыва",
+    re.IGNORECASE,
+)
+
+# Advisor responses and evaluator verdicts persisted across runs (--no-cache disables, --refresh-cache clears)
+TEST_CACHE_PATH = Path.home() / ".cache" / "shopping_advisor_tests" / "runs.sqlite"
+
+# Everything an advisor response depends on: code, prompts and model ids, and the catalog.
+# Cached responses are keyed on a hash of these files, so any change to them invalidates the cache.
+ADVISOR_SOURCES = ("advisor.py", "prompts.py", "retrieval.py", "cache.py", "products.json")
+
+
+def advisor_fingerprint() -> str:
+    """Hashes the files in ADVISOR_SOURCES."""
+    root = Path(__file__).resolve().parent.parent
+    digest = hashlib.blake2b(digest_size=16)
+    for name in ADVISOR_SOURCES:
+        digest.update(name.encode("utf-8"))
+        digest.update((root / name).read_bytes())
+    return digest.hexdigest()
+
+
+ADVISOR_FINGERPRINT = advisor_fingerprint()
+
+# --- Scenarios ---
+
+class Step(NamedTuple):
+    user_input: str
+    expected_outcome: str
+    # Optional deterministic check of the response: True/False decides the step, None defers to the evaluator
+    check: Optional[Callable[[str], Optional[bool]]] = None
+
+
+class Scenario(NamedTuple):
+    name: str
+    steps: Tuple[Step, ...]
+
+
+# Prices and RAM sizes in an advisor response (RAM only next to the word RAM/ОЗУ, so storage isn't mistaken for it)
+PRICE_RE = re.compile(r"\$\s?(\d[\d,]*)")
+RAM_RE = re.compile(r"\b(?:RAM|ОЗУ)\W{0,6}(\d+)\s?(?:GB|ГБ)|(\d+)\s?(?:GB|ГБ)\s?(?:of\s)?(?:RAM|ОЗУ)", re.IGNORECASE)
+
+
+def spec_check(min_ram_gb: int, max_price: float) -> Callable[[str], Optional[bool]]:
+    """
+    Builds a check of a laptop listing against price and RAM limits: fails when a stated price is
+    above `max_price` or a stated RAM size is below `min_ram_gb`, passes only when both prices and
+    RAM sizes were found and all are within limits, and otherwise returns None so the evaluator
+    decides (e.g. "16GB, 512GB SSD" without the word RAM).
+    """
+    def check(response: str) -> Optional[bool]:
+        prices = [float(price.replace(",", "")) for price in PRICE_RE.findall(response)]
+        ram_sizes = [int(a or b) for a, b in RAM_RE.findall(response)]
+        if any(price > max_price for price in prices) or any(ram < min_ram_gb for ram in ram_sizes):
+            return False
+        return True if prices and ram_sizes else None
+
+    return check
+
+
+def build_scenarios(definitions: List[Dict[str, Any]]) -> Tuple[Scenario, ...]:
+    """
+    Converts scenario definitions written as dicts into immutable Scenario tuples, once at import,
+    so the scenario threads share them without copying.
+    """
+    return tuple(Scenario(definition["name"], tuple(Step(**step) for step in definition["steps"])) for definition in definitions)
+
+
+# --- Test Runner & LLM-based Evaluator ---
+
+class EvaluatorPrompts(NamedTuple):
+    """The evaluator prompts of one scenario script, in its language."""
+    # Fixed system prompt, so the request prefix stays cacheable by the API
+    system: str
+    # User message template with {history}, {latest_response} and {expected_outcome} placeholders
+    user: str
+
+
+class bcolors:
+    HEADER = '\033[95m'
+    OKBLUE = '\033[94m'
+    OKCYAN = '\033[96m'
+    OKGREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+def build_evaluator_request(
+    prompts: EvaluatorPrompts, history: List[Dict[str, str]], latest_response: str, expected_outcome: str
+) -> Dict[str, Any]:
+    """
+    Builds the chat completions request body that asks the evaluator LLM for a verdict.
+    """
+    # The latest response is passed separately, so it is dropped from the history; of the earlier
+    # turns only the most recent messages are kept, as compact JSON
+    if history and history[-1] == {"role": "assistant", "content": latest_response}:
+        history = history[:-1]
+    history = history[-EVALUATOR_HISTORY_MESSAGES:]
+
+    user_prompt = prompts.user.format(
+        history=json.dumps(history, ensure_ascii=False, sort_keys=True, separators=(",", ":")),
+        latest_response=latest_response,
+        expected_outcome=expected_outcome,
+    )
+    return {
+        "model": EVALUATOR_MODEL,
+        "messages": [
+            {"role": "system", "content": prompts.system},
+            {"role": "user", "content": user_prompt},
+        ],
+        "response_format": VERDICT_FORMAT,
+        "max_tokens": 10,
+        "temperature": 0.0,
+    }
+
+
+def is_passed_verdict(content: Optional[str]) -> bool:
+    """Reads the boolean verdict from the evaluator's JSON answer; a malformed answer counts as failed."""
+    try:
+        return json.loads(content or "")["passed"] is True
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+class DiskCache:
+    """
+    On-disk cache of run results: a table `table` in SQLite keyed by a hash of the full input
+    (the evaluator request, or a message with its history and preferences), with JSON values.
+    An unchanged step is therefore sent neither to the advisor nor to the evaluator again.
+    """
+
+    def __init__(self, path: Path, table: str):
+        self.path = path
+        self.table = table
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            # WAL lets scenario threads read while another thread writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def make_key(self, payload: Any) -> str:
+        return ResponseCache.make_key(self.table, payload)
+
+    def get(self, payload: Any) -> Optional[Any]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT value FROM {self.table} WHERE key = ?", (self.make_key(payload),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, payload: Any, value: Any) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)",
+                (self.make_key(payload), json.dumps(value, ensure_ascii=False)),
+            )
+
+    def clear(self) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+
+def _compact(text: str) -> str:
+    return re.sub(r"[\s,]", "", text).lower()
+
+
+def local_verdict(latest_response: str, expected_outcome: str) -> Optional[bool]:
+    """
+    Quick verdict without an LLM call. An empty or error response fails; a response that mentions
+    every quoted name, price and size from a plain listing expectation (at least two values, no
+    constraints such as "not" or "only" and no qualitative asks such as "compare") passes.
+    Otherwise returns None and the LLM evaluator decides.
+    """
+    if not latest_response.strip() or is_error_reply(latest_response):
+        return False
+    if CONSTRAINT_RE.search(expected_outcome) or QUALITATIVE_RE.search(expected_outcome):
+        return None
+    required = ["".join(groups) for groups in REQUIRED_VALUE_RE.findall(expected_outcome)]
+    response = _compact(latest_response)
+    if len(required) >= 2 and all(_compact(value) in response for value in required):
+        return True
+    return None
+
+
+def evaluate_step(
+    prompts: EvaluatorPrompts,
+    history: List[Dict[str, str]],
+    latest_response: str,
+    expected_outcome: str,
+    client: OpenAI,
+    cache: Optional[DiskCache] = None,
+) -> bool:
+    """
+    Uses a powerful LLM to evaluate if the chatbot's response meets the test criteria.
+    """
+    verdict = local_verdict(latest_response, expected_outcome)
+    if verdict is not None:
+        return verdict
+    body = build_evaluator_request(prompts, history, latest_response, expected_outcome)
+    if cache is not None:
+        cached = cache.get(body)
+        if cached is not None:
+            return cached
+    try:
+        response = client.chat.completions.create(**body)
+        verdict = is_passed_verdict(response.choices[0].message.content)
+    except Exception as e:
+        print(f"{bcolors.FAIL}Evaluator call failed: {e}{bcolors.ENDC}")
+        return False
+    # Failed calls are not cached, only verdicts
+    if cache is not None:
+        cache.set(body, verdict)
+    return verdict
+
+
+def evaluate_batch(
+    requests: List[Tuple[str, Dict[str, Any]]],
+    client: OpenAI,
+    cache: Optional[DiskCache] = None,
+) -> Dict[str, bool]:
+    """
+    Evaluates all deferred steps with a single OpenAI Batch API job and returns the verdict
+    per `custom_id`. Steps missing from the output (failed requests) count as failed.
+    """
+    verdicts: Dict[str, bool] = {}
+    if cache is not None:
+        for custom_id, body in requests:
+            cached = cache.get(body)
+            if cached is not None:
+                verdicts[custom_id] = cached
+        requests = [(custom_id, body) for custom_id, body in requests if custom_id not in verdicts]
+    if not requests:
+        return verdicts
+
+    lines = "\n".join(
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}, ensure_ascii=False)
+        for custom_id, body in requests
+    )
+    batch_file = client.files.create(file=("evaluations.jsonl", lines.encode("utf-8")), purpose="batch")
+    batch = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h")
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(BATCH_POLL_SECONDS)
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        print(f"{bcolors.FAIL}Evaluation batch {batch.id} ended with status '{batch.status}'.{bcolors.ENDC}")
+        return verdicts
+
+    bodies = dict(requests)
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        item = json.loads(line)
+        choices = ((item.get("response") or {}).get("body") or {}).get("choices")
+        if not choices:
+            continue
+        verdicts[item["custom_id"]] = is_passed_verdict(choices[0]["message"]["content"])
+        if cache is not None:
+            cache.set(bodies[item["custom_id"]], verdicts[item["custom_id"]])
+    return verdicts
+
+
+def get_response_cached(
+    advisor: ShoppingAdvisor,
+    cache: Optional[DiskCache],
+    user_input: str,
+    history: List[Dict[str, str]],
+    preferences: Dict[str, Any],
+    language: str,
+    intent: Intent,
+) -> str:
+    """
+    Returns the advisor's response, taken from `cache` when the same message with the same
+    history and preferences was already run in an earlier run against the same advisor code,
+    prompts and catalog (ADVISOR_FINGERPRINT).
+    """
+    key = [ADVISOR_FINGERPRINT, user_input, history, preferences, language, intent]
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    response = advisor.get_response_sync(user_input, history, preferences, language=language, intent=intent)
+    if cache is not None and not is_error_reply(response):
+        cache.set(key, response)
+    return response
+
+
+def run_scenario(
+    scenario: Scenario,
+    prompts: EvaluatorPrompts,
+    client: OpenAI,
+    advisor: ShoppingAdvisor,
+    deferred: Optional[List[Dict[str, Any]]] = None,
+    cache: Optional[DiskCache] = None,
+    response_cache: Optional[DiskCache] = None,
+) -> Tuple[bool, str, List[bool]]:
+    """
+    Runs a single scenario step by step and returns whether all steps passed, together with
+    its buffered output (printed by the caller so concurrent scenarios do not interleave) and the
+    verdicts of the evaluated steps in order (empty in batch mode).
+    """
+    output = [f"\n{bcolors.HEADER}--- Running Scenario: {scenario.name} ---{bcolors.ENDC}"]
+    history: List[Dict[str, str]] = []
+    preferences: Dict[str, Any] = {}
+    scenario_passed_all_steps = True
+    # A step's verdict only decides whether to stop early, so it is evaluated in the background
+    # while the next step runs: (step index, position of its verdict line in the output, future).
+    evaluations: List[Tuple[int, int, "Future[bool]"]] = []
+    evaluator = ThreadPoolExecutor(max_workers=len(scenario.steps))
+
+    for i, step in enumerate(scenario.steps):
+        if any(future.done() and not future.result() for _, _, future in evaluations):
+            break
+        user_input = step.user_input
+        expected_outcome = step.expected_outcome
+        output.append(f"{bcolors.OKBLUE}Step {i+1}: User input: \"{user_input}\"{bcolors.ENDC}")
+
+        # Classify the input and update preferences in one concurrent round-trip
+        language, intent, new_preferences = run_async(advisor.classify(user_input))
+        if new_preferences:
+            preferences.update(new_preferences)
+
+        # Add user input to history BEFORE getting response
+        history.append({"role": "user", "content": user_input})
+
+        # Get the response
+        response = get_response_cached(advisor, response_cache, user_input, history, preferences, language, intent)
+        output.append(f"{bcolors.OKCYAN}Assistant response: \"{response}\"{bcolors.ENDC}")
+
+        # Update history with assistant response
+        history.append({"role": "assistant", "content": response})
+
+        # Evaluate the step using the LLM evaluator
+        # In batch mode the request is recorded and the verdict is collected after all scenarios ran.
+        if deferred is not None:
+            deferred.append(build_evaluator_request(prompts, history, response, expected_outcome))
+            output.append(f"{bcolors.WARNING}Step {i+1} evaluation deferred to batch.{bcolors.ENDC}")
+            continue
+
+        verdict = step.check(response) if step.check is not None else None
+        if verdict is not None:
+            future: "Future[bool]" = Future()
+            future.set_result(verdict)
+        else:
+            future = evaluator.submit(evaluate_step, prompts, list(history), response, expected_outcome, client, cache)
+        evaluations.append((i, len(output), future))
+
+    evaluator.shutdown(wait=True)
+    for i, position, future in reversed(evaluations):
+        if future.result():
+            output.insert(position, f"{bcolors.OKGREEN}Step {i+1} PASSED.{bcolors.ENDC}")
+        else:
+            output.insert(position, f"{bcolors.FAIL}Step {i+1} FAILED. The response did not meet the expected outcome.{bcolors.ENDC}")
+            scenario_passed_all_steps = False
+
+    if deferred is None:
+        output.append(scenario_summary(scenario, scenario_passed_all_steps))
+    return scenario_passed_all_steps, "\n".join(output), [future.result() for _, _, future in evaluations]
+
+
+def scenario_summary(scenario: Scenario, passed: bool) -> str:
+    """Formats the final PASSED/FAILED line of a scenario."""
+    if passed:
+        return f"{bcolors.OKGREEN}--- Scenario '{scenario.name}' PASSED ---\n{bcolors.ENDC}"
+    return f"{bcolors.FAIL}--- Scenario '{scenario.name}' FAILED ---\n{bcolors.ENDC}"
+
+
+def write_report(path: str, scenarios: Sequence[Scenario], step_verdicts: List[List[bool]]) -> None:
+    """Writes one JSON line per evaluated step, for CI dashboards and other tooling."""
+    with open(path, "w", encoding="utf-8") as f:
+        for scenario, verdicts in zip(scenarios, step_verdicts):
+            for i, passed in enumerate(verdicts):
+                record = {"scenario": scenario.name, "step": i + 1, "user_input": scenario.steps[i].user_input, "passed": passed}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def run_test_scenarios(
+    scenarios: Sequence[Scenario],
+    prompts: EvaluatorPrompts,
+    batch: bool = False,
+    use_cache: bool = True,
+    refresh_cache: bool = False,
+    report: Optional[str] = None,
+):
+    """
+    Runs the given scenarios and reports the results using an LLM evaluator.
+
+    With `batch=True` (``--batch`` on the command line) every step is run first and all
+    evaluations are submitted as one OpenAI Batch API job, which is cheaper for offline runs.
+    Advisor responses and verdicts are cached in `TEST_CACHE_PATH`; `use_cache=False` (``--no-cache``)
+    runs everything afresh and `refresh_cache=True` (``--refresh-cache``) clears the cache first.
+    `report` (``--report=PATH``) additionally writes the step verdicts to a JSON Lines file.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print(f"{bcolors.FAIL}ERROR: OPENAI_API_KEY environment variable not set.{bcolors.ENDC}")
+        return
+
+    # One keep-alive pool for the whole run: scenario threads reuse the evaluator's connections
+    # instead of new TLS handshakes; the advisor uses the shared async pool from advisor.
+    client = OpenAI(
+        api_key=api_key,
+        http_client=DefaultHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=30.0,
+        ),
+    )
+    advisor = ShoppingAdvisor(api_key=api_key)
+    cache = DiskCache(TEST_CACHE_PATH, "evaluations") if use_cache else None
+    response_cache = DiskCache(TEST_CACHE_PATH, "responses") if use_cache else None
+    if refresh_cache and use_cache:
+        cache.clear()
+        response_cache.clear()
+    total_passed = 0
+    total_failed = 0
+
+    # Scenarios are independent and I/O-bound, so they run concurrently. The advisor keeps no
+    # per-conversation state (history and preferences live in run_scenario), so it is shared.
+    deferred: List[List[Dict[str, Any]]] = [[] for _ in scenarios]
+    step_verdicts: List[List[bool]] = [[] for _ in scenarios]
+    with ThreadPoolExecutor(max_workers=len(scenarios)) as executor:
+        futures = {
+            executor.submit(
+                run_scenario, scenario, prompts, client, advisor, deferred[n] if batch else None, cache, response_cache
+            ): n
+            for n, scenario in enumerate(scenarios)
+        }
+        for future in as_completed(futures):
+            passed, output, step_verdicts[futures[future]] = future.result()
+            print(output)
+            if batch:
+                continue
+            if passed:
+                total_passed += 1
+            else:
+                total_failed += 1
+
+    if batch:
+        # All evaluations go to one Batch API job; a scenario passes when every step passed.
+        verdicts = evaluate_batch(
+            [(f"{n}_{step}", body) for n, bodies in enumerate(deferred) for step, body in enumerate(bodies)],
+            client,
+            cache,
+        )
+        for n, scenario in enumerate(scenarios):
+            step_verdicts[n] = [verdicts.get(f"{n}_{step}", False) for step in range(len(deferred[n]))]
+            passed = all(step_verdicts[n])
+            print(scenario_summary(scenario, passed))
+            if passed:
+                total_passed += 1
+            else:
+                total_failed += 1
+
+    print(f"\n{bcolors.BOLD}--- Test Summary ---{bcolors.ENDC}")
+    print(f"{bcolors.OKGREEN}Passed: {total_passed}{bcolors.ENDC}")
+    print(f"{bcolors.FAIL}Failed: {total_failed}{bcolors.ENDC}")
+    if report:
+        write_report(report, scenarios, step_verdicts)
+
+
+def main(scenarios: Sequence[Scenario], prompts: EvaluatorPrompts) -> None:
+    """Command-line entry point of the scenario scripts: --batch, --no-cache, --refresh-cache, --report=PATH."""
+    # Suppress verbose logging from the advisor during tests
+    logging.getLogger("advisor").setLevel(logging.WARNING)
+    run_test_scenarios(
+        scenarios,
+        prompts,
+        batch="--batch" in sys.argv[1:],
+        use_cache="--no-cache" not in sys.argv[1:],
+        refresh_cache="--refresh-cache" in sys.argv[1:],
+        report=next((arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--report=")), None),
+    )
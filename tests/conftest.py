@@ -0,0 +1,17 @@
+"""
+Pytest configuration for the test suite.
+
+The end-to-end scenario scripts (test_scenarios_*.py) call the OpenAI API and are meant to be
+run directly (python tests/test_scenarios_eng.py), so ordinary pytest runs do not collect them;
+pass --e2e to include them.
+"""
+
+
+def pytest_addoption(parser):
+    parser.addoption("--e2e", action="store_true", help="also collect the end-to-end scenario scripts")
+
+
+def pytest_ignore_collect(collection_path, config):
+    if collection_path.name.startswith("test_scenarios_") and not config.getoption("--e2e"):
+        return True
+    return None
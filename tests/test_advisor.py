@@ -2,41 +2,62 @@
 This module contains unit tests for the ShoppingAdvisor class.
 """
 
+import asyncio
+import httpx
+import openai
 import pytest
+import shutil
 import sys
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from advisor import ShoppingAdvisor, Intent, PRODUCT_SEARCH_SELECTION
+from advisor import RAG_ERROR_MESSAGE, ShoppingAdvisor, Intent, PreferenceBatch, UserPreference, classify_intent_locally, detect_language
+from cache import ResponseCache, SemanticCache
+from retrieval import DATA_PATH, ProductRetriever
+
+@pytest.fixture(scope="session")
+def catalog(tmp_path_factory):
+    """Provides the bundled catalog, loaded once per test session from a copy so its snapshot stays out of the source tree."""
+    path = tmp_path_factory.mktemp("catalog") / "products.json"
+    shutil.copy(DATA_PATH, path)
+    return ProductRetriever(str(path))
+
+@pytest.fixture(scope="session")
+def shared_advisor(catalog):
+    """Provides the ShoppingAdvisor built once per test session."""
+    return ShoppingAdvisor(api_key="test_key", retriever=catalog, client=MagicMock())
 
 @pytest.fixture
-def advisor():
-    """Provides a ShoppingAdvisor instance with a mocked OpenAI client."""
-    with patch("advisor.OpenAI") as MockOpenAI:
-        mock_client = MagicMock()
-        MockOpenAI.return_value = mock_client
-        advisor_instance = ShoppingAdvisor(api_key="test_key")
-        advisor_instance.retriever = MagicMock()
-        return advisor_instance
+def advisor(shared_advisor):
+    """Provides the shared ShoppingAdvisor with a fresh mocked OpenAI client, retriever and caches."""
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock()
+    shared_advisor.client = mock_client
+    shared_advisor.retriever = MagicMock()
+    shared_advisor.response_cache = ResponseCache()
+    shared_advisor.semantic_cache = None
+    shared_advisor._in_flight.clear()
+    return shared_advisor
 
 def test_preference_extraction(advisor):
     """Tests that brand preferences are correctly extracted from user input."""
     user_input = "I prefer Dell laptops"
-    
+
     # Mock the response from the preference extractor LLM call
     mock_tool_call = MagicMock()
-    mock_tool_call.function.arguments = '{"preference": {"brand": "Dell"}}'
-    
+    mock_tool_call.function.arguments = '{"intent": "product_search_selection", "preference": {"brand": "Dell"}}'
+
     mock_response = MagicMock()
     mock_response.choices[0].message.tool_calls = [mock_tool_call]
     advisor.client.chat.completions.create.return_value = mock_response
-    
-    preferences = advisor._extract_preferences(user_input)
-    
+
+    intent, preferences = asyncio.run(advisor._analyze_input(user_input))
+
     advisor.client.chat.completions.create.assert_called_once()
+    assert intent == Intent.SEARCH_SELECTION
     assert preferences is not None
     assert preferences.get("brand") == "Dell"
 
@@ -48,27 +69,373 @@ def test_get_response_applies_extracted_preferences(advisor):
     history = [{"role": "user", "content": "I like AMD processors"}]
     preferences = {"brand": "AMD"}
 
-    with patch.object(advisor, '_get_intent', return_value=Intent.SEARCH_SELECTION), \
-         patch.object(advisor, '_execute_rag_flow') as mock_rag_flow:
-        
-        advisor.get_response(user_input, history, preferences)
-        
+    async def fake_rag_flow(*args):
+        yield "ok"
+
+    with patch.object(advisor, '_analyze_input', new_callable=AsyncMock, return_value=(Intent.SEARCH_SELECTION, None)), \
+         patch.object(advisor, '_execute_rag_flow', side_effect=fake_rag_flow) as mock_rag_flow:
+
+        asyncio.run(advisor.get_response(user_input, history, preferences))
+
         mock_rag_flow.assert_called_once()
         # Verify that the brand from preferences was passed to the RAG flow
         assert mock_rag_flow.call_args[0][2]['brand'] == "AMD"
 
+def test_get_response_sync_returns_the_full_reply(advisor):
+    """Tests that the blocking wrapper runs the async flow and joins the streamed reply."""
+    async def fake_rag_flow(*args):
+        yield "Dell "
+        yield "XPS 13"
+
+    with patch.object(advisor, '_execute_rag_flow', side_effect=fake_rag_flow):
+        reply = advisor.get_response_sync("Show me Dell laptops", [], {}, language="English", intent=Intent.SEARCH_SELECTION)
+
+    assert reply == "Dell XPS 13"
+
 def test_no_preference_extraction_when_not_stated(advisor):
     """Tests that no preference is extracted when none is stated."""
     user_input = "Just show me some laptops"
-    
-    # Simulate the LLM not returning a tool call for preferences
+
+    # Simulate the LLM returning an intent without any preferences
+    mock_tool_call = MagicMock()
+    mock_tool_call.function.arguments = '{"intent": "product_search_selection", "preference": {"brand": null}}'
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.tool_calls = [mock_tool_call]
+    advisor.client.chat.completions.create.return_value = mock_response
+
+    _, preferences = asyncio.run(advisor._analyze_input(user_input))
+
+    assert preferences is None
+
+def test_message_without_preference_hints_requests_intent_only(advisor):
+    """Tests that a message with no preference cues skips the preference extraction schema."""
+    mock_tool_call = MagicMock()
+    mock_tool_call.function.arguments = '{"intent": "product_comparison"}'
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.tool_calls = [mock_tool_call]
+    advisor.client.chat.completions.create.return_value = mock_response
+
+    intent, preferences = asyncio.run(advisor._analyze_input("what about the second one?"))
+
+    request = advisor.client.chat.completions.create.call_args.kwargs
+    assert request["tool_choice"]["function"]["name"] == "IntentRouter"
+    assert intent == Intent.COMPARISON
+    assert preferences is None
+
+def test_malformed_analysis_falls_back_without_retrying(advisor):
+    """Tests that an unparseable analysis response is not retried."""
     mock_response = MagicMock()
     mock_response.choices[0].message.tool_calls = []
     advisor.client.chat.completions.create.return_value = mock_response
-    
-    preferences = advisor._extract_preferences(user_input)
-    
+
+    intent, preferences = asyncio.run(advisor._analyze_input("I prefer AMD processors"))
+
+    advisor.client.chat.completions.create.assert_called_once()
+    assert intent == Intent.GENERAL_INQUIRY
+    assert preferences is None
+
+def test_transient_analysis_error_falls_back_without_extra_retries(advisor):
+    """Tests that a persistent API error is not retried on top of the client's own retries."""
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    advisor.client.chat.completions.create.side_effect = openai.APIConnectionError(request=request)
+
+    intent, preferences = asyncio.run(advisor._analyze_input("Something with a good screen"))
+
+    advisor.client.chat.completions.create.assert_called_once()
+    assert intent == Intent.GENERAL_INQUIRY
+    assert preferences is None
+
+def test_locally_extracted_preferences_need_intent_only(advisor):
+    """Tests that brand, RAM and budget are read locally and the model is only asked for the intent."""
+    mock_tool_call = MagicMock()
+    mock_tool_call.function.arguments = '{"intent": "product_search_selection"}'
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.tool_calls = [mock_tool_call]
+    advisor.client.chat.completions.create.return_value = mock_response
+
+    intent, preferences = asyncio.run(advisor._analyze_input("Any Dell laptops with 32GB RAM up to $2,000?"))
+
+    request = advisor.client.chat.completions.create.call_args.kwargs
+    assert request["tool_choice"]["function"]["name"] == "IntentRouter"
+    assert intent == Intent.SEARCH_SELECTION
+    assert preferences == {"brand": "Dell", "min_ram_gb": 32, "max_price": 2000}
+
+def test_keyword_cues_classify_intent_without_a_call(advisor):
+    """Tests that an unambiguous keyword cue settles the intent without calling the model."""
+    intent, preferences = asyncio.run(advisor._analyze_input("Compare the Dell XPS 13 with the HP Envy 15"))
+
+    advisor.client.chat.completions.create.assert_not_called()
+    assert intent == Intent.COMPARISON
     assert preferences is None
 
+@pytest.mark.parametrize("text, expected", [
+    ("Сравни Dell XPS 13 и HP Envy 15", Intent.COMPARISON),
+    ("Tell me more about the 'ThinkBok Pro'", Intent.INFORMATION_DETAILS),
+    ("Найди что-нибудь дешевле", Intent.SEARCH_SELECTION),
+    ("Which is better for gaming, the best ASUS or MSI?", None),
+    ("Which one has more storage?", None),
+])
+def test_classify_intent_locally(text, expected):
+    """Tests that only cues pointing to a single intent are classified locally."""
+    assert classify_intent_locally(text) == expected
+
+def test_several_brands_are_not_a_brand_preference(advisor):
+    """Tests that listing several brands does not store any of them as the preferred brand."""
+    preferences, _ = advisor._extract_local_preferences("Show me laptops from Dell and HP")
+
+    assert "brand" not in preferences
+
+@pytest.mark.parametrize("text", [
+    "under 15 inches",
+    "less than 2 kg",
+    "more than 512GB storage",
+    "laptops from 2023",
+    "до 14 дюймов",
+    "over 8 hours battery",
+    "under 1.5 kg",
+    "HP Envy 15 details",
+    "I don't want Dell",
+])
+def test_sizes_negations_and_product_names_are_not_preferences(advisor, text):
+    """Tests that numbers with units, negated brands and brands inside product names are not stored as preferences."""
+    preferences, _ = advisor._extract_local_preferences(text)
+
+    assert preferences == {}
+
+@pytest.mark.parametrize("text, expected", [
+    ("under $2000", {"max_price": 2000}),
+    ("дешевле 1500 долларов", {"max_price": 1500}),
+    ("бюджет до 1500", {"max_price": 1500}),
+    ("не дороже 1500", {"max_price": 1500}),
+    ("Show me laptops for no more than $1500", {"max_price": 1500}),
+    ("not over $1200", {"max_price": 1200}),
+    ("Dell laptops no less than $1000", {"brand": "Dell", "min_price": 1000}),
+    ("laptops less than $2k please", {"max_price": 2000}),
+    ("something under $1.5k", {"max_price": 1500}),
+    ("not Dell, I want HP", {"brand": "HP"}),
+])
+def test_budget_and_brand_are_extracted_locally(advisor, text, expected):
+    """Tests that budgets next to a currency or price word (negated bounds inverted, "k" amounts expanded)
+    and a brand outside a negation are read locally."""
+    preferences, _ = advisor._extract_local_preferences(text)
+
+    assert preferences == expected
+
+def test_model_preferences_win_over_local_ones(advisor):
+    """Tests that locally extracted values only fill in keys the model left out."""
+    mock_tool_call = MagicMock()
+    mock_tool_call.function.arguments = '{"intent": "product_search_selection", "preference": {"max_price": 1800}}'
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.tool_calls = [mock_tool_call]
+    advisor.client.chat.completions.create.return_value = mock_response
+
+    _, preferences = asyncio.run(advisor._analyze_input("Dell with a 15 inch screen under $2000, ideally around 1800"))
+
+    assert preferences == {"brand": "Dell", "max_price": 1800}
+
+def test_classify_returns_language_intent_and_preferences(advisor):
+    """Tests that classify combines local language detection with the intent and preference analysis."""
+    with patch.object(advisor, '_analyze_input', new_callable=AsyncMock, return_value=(Intent.COMPARISON, {"brand": "HP"})):
+
+        language, intent, preferences = asyncio.run(advisor.classify("Сравни ноутбуки HP"))
+
+    assert language == "Russian"
+    assert intent == Intent.COMPARISON
+    assert preferences == {"brand": "HP"}
+
+@pytest.mark.parametrize("text, expected", [
+    ("Compare the Dell XPS 13 with the HP Envy 15", "English"),
+    ("Сравни Dell XPS 13 и HP Envy 15", "Russian"),
+    ("спасибо", "Russian"),
+    ("1500?", "Russian"),
+])
+def test_detect_language(text, expected):
+    """Tests script-based language detection, including the fallback for input without letters."""
+    assert detect_language(text, default="Russian") == expected
+
+def test_repeated_input_uses_response_cache(advisor):
+    """Tests that an identical classifier request is served from the response cache."""
+    mock_tool_call = MagicMock()
+    mock_tool_call.function.arguments = '{"intent": "product_search_selection", "preference": {"brand": "Dell"}}'
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.tool_calls = [mock_tool_call]
+    advisor.client.chat.completions.create.return_value = mock_response
+
+    first = asyncio.run(advisor._analyze_input("I prefer Dell laptops"))
+    second = asyncio.run(advisor._analyze_input("I prefer Dell laptops"))
+
+    advisor.client.chat.completions.create.assert_called_once()
+    assert first == second == (Intent.SEARCH_SELECTION, {"brand": "Dell"})
+
+def test_concurrent_identical_inputs_share_one_call(advisor):
+    """Tests that identical classifier requests in flight at the same time make a single API call."""
+    mock_tool_call = MagicMock()
+    mock_tool_call.function.arguments = '{"intent": "product_search_selection", "preference": {"brand": "Dell"}}'
+
+    mock_response = MagicMock()
+    mock_response.choices[0].message.tool_calls = [mock_tool_call]
+
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.01)
+        return mock_response
+
+    advisor.client.chat.completions.create.side_effect = slow_create
+
+    async def analyze_twice():
+        return await asyncio.gather(*(advisor._analyze_input("I prefer Dell laptops") for _ in range(2)))
+
+    first, second = asyncio.run(analyze_twice())
+
+    advisor.client.chat.completions.create.assert_called_once()
+    assert first == second == (Intent.SEARCH_SELECTION, {"brand": "Dell"})
+
+def test_final_rag_answer_is_streamed(advisor):
+    """Tests that the summary after a tool call is streamed chunk by chunk."""
+    tool_call = MagicMock()
+    tool_call.id = "call_1"
+    tool_call.function.name = "ProductSearchTool"
+    tool_call.function.arguments = '{"brand": "Dell"}'
+
+    first_response = MagicMock()
+    first_response.choices[0].message.tool_calls = [tool_call]
+    first_response.choices[0].message.model_dump.return_value = {"role": "assistant", "content": None}
+    first_response.choices[0].message.model_dump_json.return_value = "{}"
+
+    async def final_stream():
+        for text in ["Dell ", "XPS 13"]:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = text
+            yield chunk
+
+    advisor.client.chat.completions.create.side_effect = [first_response, final_stream()]
+    advisor.retriever.search_products.return_value = []
+
+    async def collect():
+        flow = advisor._execute_rag_flow([], "system", {}, "English")
+        return [chunk async for chunk in flow]
+
+    assert asyncio.run(collect()) == ["Dell ", "XPS 13"]
+    assert advisor.client.chat.completions.create.call_args.kwargs["stream"] is True
+
+def test_search_with_stored_filters_skips_tool_selection_call(advisor):
+    """Tests that a search request with stored filters is retrieved up front and answered in one call."""
+    async def final_stream():
+        chunk = MagicMock()
+        chunk.choices[0].delta.content = "Dell XPS 13"
+        yield chunk
+
+    advisor.client.chat.completions.create.side_effect = [final_stream()]
+    advisor.retriever.search_products.return_value = [{"name": "Dell XPS 13"}]
+    preferences = {"brand": "Dell", "min_storage_gb": 512}
+
+    async def collect():
+        flow = advisor._execute_rag_flow([], "system", preferences, "English", Intent.SEARCH_SELECTION)
+        return [chunk async for chunk in flow]
+
+    assert asyncio.run(collect()) == ["Dell XPS 13"]
+    advisor.client.chat.completions.create.assert_called_once()
+    advisor.retriever.search_products.assert_called_once_with(brand="Dell")
+
+def test_search_with_extra_terms_uses_tool_selection(advisor):
+    """Tests that stored filters don't bypass the model when the message asks for more (e.g. a GPU)."""
+    tool_call = MagicMock()
+    tool_call.id = "call_1"
+    tool_call.function.name = "ProductSearchTool"
+    tool_call.function.arguments = '{"query": "gaming", "gpu": "RTX"}'
+
+    first_response = MagicMock()
+    first_response.choices[0].message.tool_calls = [tool_call]
+    first_response.choices[0].message.model_dump.return_value = {"role": "assistant", "content": None}
+
+    async def final_stream():
+        chunk = MagicMock()
+        chunk.choices[0].delta.content = "MSI"
+        yield chunk
+
+    advisor.client.chat.completions.create.side_effect = [first_response, final_stream()]
+    advisor.retriever.search_products.return_value = []
+    history = [{"role": "user", "content": "gaming laptops with RTX"}]
+
+    async def collect():
+        flow = advisor._execute_rag_flow(history, "system", {"max_price": 1500}, "English", Intent.SEARCH_SELECTION)
+        return [chunk async for chunk in flow]
+
+    assert asyncio.run(collect()) == ["MSI"]
+    advisor.retriever.search_products.assert_called_once_with(max_price=1500, query="gaming", gpu="RTX")
+
+def test_intent_follows_the_static_system_prompt(advisor):
+    """Tests that the system prompt is the same for every intent and the intent is sent after the history."""
+    response = MagicMock()
+    response.choices[0].message.tool_calls = None
+    response.choices[0].message.content = "Hello!"
+    advisor.client.chat.completions.create.return_value = response
+    history = [{"role": "user", "content": "Compare them"}]
+
+    async def run(intent):
+        flow = advisor._execute_rag_flow(history, "system", {}, "English", intent)
+        return [chunk async for chunk in flow]
+
+    asyncio.run(run(Intent.COMPARISON))
+    comparison_messages = advisor.client.chat.completions.create.call_args.kwargs["messages"]
+    asyncio.run(run(Intent.GENERAL_INQUIRY))
+    inquiry_messages = advisor.client.chat.completions.create.call_args.kwargs["messages"]
+
+    assert comparison_messages[:2] == inquiry_messages[:2]
+    assert comparison_messages[-1] == {"role": "system", "content": "Intent: product_comparison"}
+
+def test_batch_preference_extraction_uses_one_call(advisor):
+    """Tests that preferences for several replayed messages come from a single call, one entry per message."""
+    mock_response = MagicMock()
+    mock_response.choices[0].message.parsed = PreferenceBatch(
+        preferences=[UserPreference(cpu_brand="AMD"), UserPreference(), UserPreference(brand="Samsung")]
+    )
+    advisor.client.chat.completions.parse = AsyncMock(return_value=mock_response)
+
+    preferences = asyncio.run(advisor.extract_preferences_batch(
+        ["I prefer AMD processors", "Show me Dell laptops", "I like Samsung"]
+    ))
+
+    advisor.client.chat.completions.parse.assert_called_once()
+    assert preferences == [{"cpu_brand": "AMD"}, {"brand": "Dell"}, {}]
+
+def test_similar_question_is_answered_from_semantic_cache(advisor):
+    """Tests that a second, similar question in the same context skips the RAG flow."""
+    advisor.semantic_cache = SemanticCache()
+    embedding_response = MagicMock()
+    embedding_response.data[0].embedding = [1.0, 0.0]
+    advisor.client.embeddings.create = AsyncMock(return_value=embedding_response)
+
+    async def fake_rag_flow(*args):
+        yield "Dell XPS 13"
+
+    with patch.object(advisor, '_execute_rag_flow', side_effect=fake_rag_flow) as mock_rag_flow:
+        first = asyncio.run(advisor.get_response("Show me Dell laptops", [], {}, language="English", intent=Intent.SEARCH_SELECTION))
+        second = asyncio.run(advisor.get_response("show me dell laptops?", [], {}, language="English", intent=Intent.SEARCH_SELECTION))
+
+    mock_rag_flow.assert_called_once()
+    assert first == second == "Dell XPS 13"
+
+def test_partially_streamed_error_reply_is_not_cached(advisor):
+    """Tests that a reply whose stream failed midway is not stored in the semantic cache."""
+    advisor.semantic_cache = SemanticCache()
+    embedding_response = MagicMock()
+    embedding_response.data[0].embedding = [1.0, 0.0]
+    advisor.client.embeddings.create = AsyncMock(return_value=embedding_response)
+
+    async def failing_rag_flow(*args):
+        yield "Dell XPS 13 costs"
+        yield RAG_ERROR_MESSAGE
+
+    with patch.object(advisor, '_execute_rag_flow', side_effect=failing_rag_flow):
+        reply = asyncio.run(advisor.get_response("Show me Dell laptops", [], {}, language="English", intent=Intent.SEARCH_SELECTION))
+
+    assert reply == "Dell XPS 13 costs" + RAG_ERROR_MESSAGE
+    assert len(advisor.semantic_cache) == 0
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,87 @@
+"""
+This module contains unit tests for the response caches.
+"""
+
+import sys
+import os
+
+# Add the parent directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import ResponseCache, SemanticCache
+
+def test_response_cache_evicts_least_recently_used():
+    """Tests that the exact-match cache drops the least recently used entry when full."""
+    cache = ResponseCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+def test_semantic_cache_matches_similar_queries_with_the_same_key():
+    """Tests that a close embedding hits only when the context key matches."""
+    cache = SemanticCache(threshold=0.9)
+    cache.add("show me dell laptops", [1.0, 0.0, 0.0], "key", "Dell XPS 13")
+
+    assert cache.lookup([0.99, 0.05, 0.0], "key") == "Dell XPS 13"
+    assert cache.lookup([0.99, 0.05, 0.0], "other-key") is None
+    assert cache.lookup([0.0, 1.0, 0.0], "key") is None
+
+def test_semantic_cache_persists_entries(tmp_path):
+    """Tests that cached answers are reloaded from disk."""
+    path = str(tmp_path / "semantic_cache")
+    cache = SemanticCache(path)
+    cache.add("show me dell laptops", [1.0, 0.0], "key", "Dell XPS 13")
+    cache.save()
+
+    reloaded = SemanticCache(path)
+
+    assert len(reloaded) == 1
+    assert reloaded.lookup([1.0, 0.0], "key") == "Dell XPS 13"
+
+def test_semantic_cache_ignores_mismatched_files(tmp_path):
+    """Tests that a cache whose embeddings and entries don't match starts empty instead of failing."""
+    path = str(tmp_path / "semantic_cache")
+    cache = SemanticCache(path)
+    cache.add("show me dell laptops", [1.0, 0.0], "key", "Dell XPS 13")
+    cache.save()
+    (tmp_path / "semantic_cache.json").write_text("[]", encoding="utf-8")
+
+    reloaded = SemanticCache(path)
+
+    assert len(reloaded) == 0
+    assert reloaded.lookup([1.0, 0.0], "key") is None
+
+def test_semantic_cache_evicts_least_recently_used_and_counts_hits():
+    """Tests LRU eviction when full and the hit rate used for tuning the threshold."""
+    cache = SemanticCache(threshold=0.9, max_entries=2)
+    cache.add("dell", [1.0, 0.0, 0.0], "key", "Dell")
+    cache.add("hp", [0.0, 1.0, 0.0], "key", "HP")
+    assert cache.lookup([1.0, 0.0, 0.0], "key") == "Dell"
+
+    cache.add("apple", [0.0, 0.0, 1.0], "key", "Apple")
+
+    assert len(cache) == 2
+    assert cache.lookup([0.0, 1.0, 0.0], "key") is None
+    assert cache.lookup([1.0, 0.0, 0.0], "key") == "Dell"
+    assert cache.hit_rate == 2 / 3
+
+def test_semantic_cache_overwrites_evicted_rows_in_place_and_batches_saves(tmp_path):
+    """Tests that the embedding array is allocated once and the cache is only due for saving every few adds."""
+    cache = SemanticCache(str(tmp_path / "semantic_cache"), max_entries=2, save_every=3)
+    cache.add("dell", [1.0, 0.0], "key", "Dell")
+    embeddings = cache._embeddings
+    cache.add("hp", [0.0, 1.0], "key", "HP")
+    assert not cache.save_due
+
+    cache.add("apple", [0.6, 0.8], "key", "Apple")
+
+    assert cache._embeddings is embeddings
+    assert cache.save_due
+    cache.save()
+    assert not cache.save_due
+    assert len(SemanticCache(str(tmp_path / "semantic_cache"))) == 2
@@ -0,0 +1,108 @@
+"""
+This module contains unit tests for the ProductRetriever class.
+"""
+
+import json
+import pytest
+import sys
+import os
+import shutil
+import time
+
+# Add the parent directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import DATA_PATH, ProductRetriever
+
+@pytest.fixture(scope="module")
+def retriever(tmp_path_factory):
+    """Provides a ProductRetriever over a copy of the bundled catalog, so its snapshot stays out of the source tree."""
+    catalog = tmp_path_factory.mktemp("catalog") / "products.json"
+    shutil.copy(DATA_PATH, catalog)
+    return ProductRetriever(str(catalog))
+
+def test_brand_filter_is_case_insensitive(retriever):
+    """Tests that brand filtering ignores case and keeps only that brand."""
+    results = retriever.search_products(brand="dell", limit=50)
+
+    assert results
+    assert {r["brand"] for r in results} == {"Dell"}
+
+def test_misspelled_brand_resolves_to_catalog_brand(retriever):
+    """Tests that a close misspelling of a brand filters by that brand, while unknown brands match nothing."""
+    assert {r["brand"] for r in retriever.search_products(brand="Lenova", limit=50)} == {"Lenovo"}
+    assert retriever.search_products(brand="Samsung", limit=50) == []
+
+def test_filters_combine_with_inclusive_max_price(retriever):
+    """Tests that price, RAM and CPU filters all apply and max_price is inclusive."""
+    results = retriever.search_products(max_price=1499, min_ram_gb=32, cpu_brand="AMD", limit=50)
+
+    assert {r["sku"] for r in results} == {"DEL-INSPIRON-16-5635-32-1TB-R7"}
+
+def test_default_availability_excludes_out_of_stock(retriever):
+    """Tests that out-of-stock variants are hidden unless explicitly requested."""
+    skus = {r["sku"] for r in retriever.search_products(brand="Apple", limit=50)}
+    out_of_stock = retriever.search_products(brand="Apple", availability=["out_of_stock"], limit=50)
+
+    assert "APL-MBA-13-M2-8-256" not in skus
+    assert [r["sku"] for r in out_of_stock] == ["APL-MBA-13-M2-8-256"]
+
+def test_dedicated_gpu_filter(retriever):
+    """Tests that a generic 'dedicated' GPU request excludes integrated graphics."""
+    results = retriever.search_products(gpu="dedicated", limit=50)
+
+    assert results
+    assert all(r["gpu"] != "integrated" for r in results)
+
+def test_query_ranks_matching_models_first(retriever):
+    """Tests that the free-text query ranks matches first without filtering out other products."""
+    results = retriever.search_products(query="dell xps 13", limit=50)
+
+    assert results[0]["model"].startswith("XPS 13")
+    assert len(results) > 2
+
+def test_empty_result_relaxes_price(retriever):
+    """Tests that a search with no matches falls back to a 10% higher price cap."""
+    results = retriever.search_products(brand="Acer", max_price=950, limit=50)
+
+    assert [r["sku"] for r in results] == ["ACR-SWIFT-3-14-16-512-R5"]
+
+def test_fallback_keeps_availability(retriever):
+    """Tests that the relaxed-price fallback still applies the availability filter."""
+    assert [r["sku"] for r in retriever.search_products(brand="HP", max_price=1200)] == ["HP-ENVY-15-16-512-I7"]
+    assert retriever.search_products(brand="HP", max_price=1200, availability=["in_stock"]) == []
+
+@pytest.mark.parametrize("query, model", [
+    ("ThinkBok Pro", "ThinkBook 14 G3"),
+    ("Макбук Эйр 13", "MacBook Air 13 (M2)"),
+    ("Inspirion 16", "Inspiron 16 (5635)"),
+])
+def test_query_tolerates_typos_and_aliases(retriever, query, model):
+    """Tests that misspelled names and Russian aliases rank the intended product first."""
+    assert retriever.search_products(query=query)[0]["model"] == model
+
+def test_snapshot_is_reused(tmp_path):
+    """Tests that a second retriever loads the pickled snapshot and returns the same results."""
+    catalog = tmp_path / "products.json"
+    shutil.copy(DATA_PATH, catalog)
+    fresh = ProductRetriever(str(catalog))
+    assert (tmp_path / "products.snap").exists()
+
+    cached = ProductRetriever(str(catalog))
+    assert cached.search_products(brand="Dell", max_price=1500, limit=50) == fresh.search_products(brand="Dell", max_price=1500, limit=50)
+
+def test_snapshot_is_rebuilt_when_the_catalog_changes(tmp_path):
+    """Tests that a snapshot of a different catalog is not loaded, whatever the file times say."""
+    catalog = tmp_path / "products.json"
+    shutil.copy(DATA_PATH, catalog)
+    ProductRetriever(str(catalog))
+    products = json.loads(catalog.read_text(encoding="utf-8"))
+    catalog.write_text(json.dumps([p for p in products if p["brand"] != "Dell"]), encoding="utf-8")
+    os.utime(tmp_path / "products.snap", (time.time() + 60, time.time() + 60))
+
+    assert ProductRetriever(str(catalog)).search_products(brand="Dell") == []
+
+def test_zero_bounds_are_applied(retriever):
+    """Tests that a zero price bound is treated as a real bound rather than as no filter."""
+    assert retriever.search_products(max_price=0, limit=50) == []
+    assert retriever.search_products(min_price=0, limit=50) == retriever.search_products(limit=50)
@@ -1,9 +1,10 @@
 """
+PYTEST_DONT_REWRITE
 End-to-end test scenarios for the shopping assistant chatbot using an LLM evaluator.
 
 This script runs a series of predefined conversational scenarios against the ShoppingAdvisor
 to verify its core functionalities. Instead of simple keyword matching, it uses a powerful
-LLM (gpt-4.1) to evaluate if the chatbot's response correctly addresses the user's
+LLM (gpt-4o-mini with a structured verdict) to evaluate if the chatbot's response correctly addresses the user's
 request in each step.
 
 Usage:
@@ -12,25 +13,21 @@ Usage:
 """
 
 import os
-import json
-import logging
 import sys
-from typing import List, Dict, Any
-from openai import OpenAI
 
-# Add the parent directory to the path so we can import advisor
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from advisor import ShoppingAdvisor, Intent
+# Add this directory to the path so the shared runner can be imported
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from _scenario_runner import EvaluatorPrompts, build_scenarios, main, spec_check
 
-# --- Test Scenarios ---
-
-TEST_SCENARIOS = [
+# Scenarios, written as dicts and converted once at import into immutable tuples (see _scenario_runner)
+_SCENARIO_DEFINITIONS = [
     {
         "name": "Scenario 1: Product Search with Filters",
         "steps": [
             {
                 "user_input": "Show me laptops with 32GB RAM cheaper than $2000",
                 "expected_outcome": "Accepted outcome is a list of provided laptops that are under 2000$ and have 32GB RAM. We trust the values in the output, so we only check that the output doesn't have laptops that state they are under 32GB RAM or over2000$",
+                "check": spec_check(min_ram_gb=32, max_price=2000),
             }
         ],
     },
@@ -88,24 +85,12 @@ TEST_SCENARIOS = [
     },
 ]
 
-# --- Test Runner & LLM-based Evaluator ---
-
-class bcolors:
-    HEADER = '\033[95m'
-    OKBLUE = '\033[94m'
-    OKCYAN = '\033[96m'
-    OKGREEN = '\033[92m'
-    WARNING = '\033[93m'
-    FAIL = '\033[91m'
-    ENDC = '\033[0m'
-    BOLD = '\033[1m'
-    UNDERLINE = '\033[4m'
+TEST_SCENARIOS = build_scenarios(_SCENARIO_DEFINITIONS)
 
-def evaluate_step(history: List[Dict[str, str]], latest_response: str, expected_outcome: str, client: OpenAI) -> bool:
-    """
-    Uses a powerful LLM to evaluate if the chatbot's response meets the test criteria.
-    """
-    system_prompt = """
+# The evaluator's system prompt is a fixed constant, so it always forms the same request prefix
+# and can be served from the API's prompt prefix cache; the per-step data comes after it.
+EVALUATOR_PROMPTS = EvaluatorPrompts(
+    system="""
 You are an intelligent test evaluator. Your goal is to assess if the assistant's response
 semantically satisfies the user's request, based on the conversation history and an
 expected outcome. Be flexible with phrasing.
@@ -115,19 +100,15 @@ expected outcome. Be flexible with phrasing.
 2.  **Assess the Assistant's Response**: Read the `Assistant's Latest Response`. Does it successfully address the user's goal?
 3.  **Focus on Facts, Not Phrasing**: The exact wording is not important. The key is whether the information provided is correct and complete according to the `Expected Outcome`. Minor phrasing differences or responding in a different language than the request are acceptable as long as the core information is correct.
 4.  **Make a decision**:
-    - If the response contains the correct key information and addresses the user's goal, respond with **'PASSED'**.
-    - If the response is factually incorrect, misses key information mentioned in the `Expected Outcome`, or completely fails to address the user's goal, respond with **'FAILED'**.
-
-**Your response must be a single word: either `PASSED` or `FAILED`. Do not provide any explanation.**
-"""
+    - If the response contains the correct key information and addresses the user's goal, return `passed: true`.
+    - If the response is factually incorrect, misses key information mentioned in the `Expected Outcome`, or completely fails to address the user's goal, return `passed: false`.
 
-    # Format the history for the evaluator prompt
-    formatted_history = "\n".join([f"- {msg['role']}: {msg['content']}" for msg in history])
-    
-    user_prompt = f"""
+**Respond only with JSON of the form `{"passed": true}` or `{"passed": false}`. Do not provide any explanation.**
+""",
+    user="""
 **Conversation History:**
 ```json
-{json.dumps(history, indent=2)}
+{history}
 ```
 
 **Assistant's Latest Response:**
@@ -140,87 +121,9 @@ expected outcome. Be flexible with phrasing.
 
 ---
 Based on all the provided information, did the assistant's response meet the expected outcome?
-"""
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4.1",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            max_tokens=10,
-            temperature=0.0,
-        )
-        result = response.choices[0].message.content.strip().upper()
-        return result == "PASSED"
-    except Exception as e:
-        print(f"{bcolors.FAIL}Evaluator call failed: {e}{bcolors.ENDC}")
-        return False
-
-
-def run_test_scenarios():
-    """
-    Runs all defined test scenarios and reports the results using an LLM evaluator.
-    """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        print(f"{bcolors.FAIL}ERROR: OPENAI_API_KEY environment variable not set.{bcolors.ENDC}")
-        return
-
-    client = OpenAI(api_key=api_key)
-    advisor = ShoppingAdvisor(api_key=api_key)
-    total_passed = 0
-    total_failed = 0
-
-    for scenario in TEST_SCENARIOS:
-        print(f"\n{bcolors.HEADER}--- Running Scenario: {scenario['name']} ---{bcolors.ENDC}")
-        
-        history: List[Dict[str, str]] = []
-        preferences: Dict[str, Any] = {}
-        scenario_passed_all_steps = True
-
-        for i, step in enumerate(scenario["steps"]):
-            user_input = step['user_input']
-            expected_outcome = step['expected_outcome']
-            print(f"{bcolors.OKBLUE}Step {i+1}: User input: \"{user_input}\"{bcolors.ENDC}")
-
-            # Update preferences from the new input
-            new_preferences = advisor._extract_preferences(user_input)
-            if new_preferences:
-                preferences.update(new_preferences)
-
-            # Add user input to history BEFORE getting response
-            history.append({"role": "user", "content": user_input})
-
-            # Get the response
-            response = advisor.get_response(user_input, history, preferences)
-            print(f"{bcolors.OKCYAN}Assistant response: \"{response}\"{bcolors.ENDC}")
-            
-            # Update history with assistant response
-            history.append({"role": "assistant", "content": response})
-
-            # Evaluate the step using the LLM evaluator
-            is_passed = evaluate_step(history, response, expected_outcome, client)
-            
-            if not is_passed:
-                print(f"{bcolors.FAIL}Step {i+1} FAILED. The response did not meet the expected outcome.{bcolors.ENDC}")
-                scenario_passed_all_steps = False
-                break
-            else:
-                print(f"{bcolors.OKGREEN}Step {i+1} PASSED.{bcolors.ENDC}")
-
-        if scenario_passed_all_steps:
-            total_passed += 1
-            print(f"{bcolors.OKGREEN}--- Scenario '{scenario['name']}' PASSED ---\n{bcolors.ENDC}")
-        else:
-            total_failed += 1
-            print(f"{bcolors.FAIL}--- Scenario '{scenario['name']}' FAILED ---\n{bcolors.ENDC}")
+""",
+)
 
-    print(f"\n{bcolors.BOLD}--- Test Summary ---{bcolors.ENDC}")
-    print(f"{bcolors.OKGREEN}Passed: {total_passed}{bcolors.ENDC}")
-    print(f"{bcolors.FAIL}Failed: {total_failed}{bcolors.ENDC}")
 
 if __name__ == "__main__":
-    # Suppress verbose logging from the advisor during tests
-    logging.getLogger("advisor").setLevel(logging.WARNING)
-    run_test_scenarios()
+    main(TEST_SCENARIOS, EVALUATOR_PROMPTS)